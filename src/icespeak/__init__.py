@@ -22,7 +22,7 @@ along with this program.  If not, see http://www.gnu.org/licenses/.
 from .parser import GreynirSSMLParser, gssml
 from .settings import SETTINGS
 from .transcribe import DefaultTranscriber, TranscriptionOptions
-from .tts import VOICES, TTSOutput, tts_to_file
+from .tts import VOICES, TTSOutput, tts_to_file, tts_to_files_async
 from .voices import TTSOptions
 
 __all__ = (
@@ -34,5 +34,6 @@ __all__ = (
     "VOICES",
     "gssml",
     "tts_to_file",
+    "tts_to_files_async",
     "TTSOutput",
 )
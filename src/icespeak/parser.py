@@ -36,7 +36,7 @@ from logging import getLogger
 
 from .settings import SETTINGS, TRACE
 from .transcribe import DefaultTranscriber, TranscriptionMethod
-from .tts import SERVICES, VOICES
+from .tts import VOICE_TO_SERVICE, VOICES
 
 _LOG = getLogger(__name__)
 GSSML_TAG = "greynir"
@@ -102,9 +102,9 @@ class GreynirSSMLParser(HTMLParser):
             voice = SETTINGS.DEFAULT_VOICE
 
         # Fetch transcriber for this voice
-        service = VOICES[voice].get("service")
+        service = VOICE_TO_SERVICE.get(voice)
         self._handler: type[DefaultTranscriber]
-        self._handler = SERVICES[service].Transcriber if service else DefaultTranscriber
+        self._handler = service.Transcriber if service else DefaultTranscriber
 
         self._str_stack: deque[str] = deque()
         self._attr_stack: deque[dict[str, str | None]] = deque()
@@ -23,8 +23,10 @@ Shared settings for the Icespeak package.
 
 # We dont import annotations from __future__ here
 # due to pydantic
+from types import MappingProxyType
 from typing import Any, Optional
 
+import itertools
 import json
 import os
 import tempfile
@@ -61,19 +63,38 @@ MAX_SPEED = 2.0
 MIN_SPEED = 0.5
 
 FALLBACK_SUFFIX = "data"
-AUDIOFMT_TO_SUFFIX = {
-    "mp3": "mp3",
-    "wav": "wav",
-    "ogg_vorbis": "ogg",
-    "pcm": "pcm",
-    # Recommended filename extension for Ogg Opus files is '.opus'.
-    "opus": "opus",
-}
+AUDIOFMT_TO_SUFFIX = MappingProxyType(
+    {
+        "mp3": "mp3",
+        "wav": "wav",
+        "ogg_vorbis": "ogg",
+        "pcm": "pcm",
+        # Recommended filename extension for Ogg Opus files is '.opus'.
+        "opus": "opus",
+    }
+)
+_suffix_get = AUDIOFMT_TO_SUFFIX.get
+
+# Output filenames are a random per-process prefix plus a counter,
+# unique across processes without reading random bytes for every file
+# (next() on itertools.count is atomic, so this is thread safe)
+_FILENAME_PREFIX = uuid.uuid4().hex
+_FILENAME_COUNTER = itertools.count()
+
+
+def _new_filename_prefix() -> None:
+    global _FILENAME_PREFIX
+    _FILENAME_PREFIX = uuid.uuid4().hex
+
+
+if hasattr(os, "register_at_fork"):
+    # Forked processes (e.g. preloaded server workers) need their own prefix
+    os.register_at_fork(after_in_child=_new_filename_prefix)
 
 
 def suffix_for_audiofmt(fmt: str) -> str:
     """Returns file suffix for the given audio format."""
-    return AUDIOFMT_TO_SUFFIX.get(fmt, FALLBACK_SUFFIX)
+    return _suffix_get(fmt, FALLBACK_SUFFIX)
 
 
 class Settings(BaseSettings):
@@ -113,12 +134,64 @@ class Settings(BaseSettings):
             "If not set, creates a directory in the platform's temporary directory."
         ),
     )
+    AUDIO_CACHE_ENABLED: bool = Field(
+        default=False,
+        description=(
+            "If True, results of tts_to_file are cached in memory, so repeated requests "
+            "return the same audio file. Cached files are shared between callers and, "
+            "if AUDIO_CACHE_CLEAN is True, deleted when evicted from the cache."
+        ),
+    )
     AUDIO_CACHE_SIZE: int = Field(
         default=300, gt=-1, description="Max number of audio files to cache."
     )
+    AUDIO_CACHE_MAX_KEY_LEN: int = Field(
+        default=4096,
+        gt=0,
+        description="Untranscribed texts longer than this (in characters) bypass the audio cache.",
+    )
     AUDIO_CACHE_CLEAN: bool = Field(
         default=True, description="If True, cleans up generated audio files upon exit."
     )
+    AUDIO_MAX_UNCACHED_FILES: Optional[int] = Field(
+        default=None,
+        gt=0,
+        description=(
+            "If set and AUDIO_CACHE_CLEAN is True, max number of generated audio files outside "
+            "the audio cache kept while running. Beyond this, the oldest of them are deleted, "
+            "even if callers might still be using them. If not set, they are deleted upon exit."
+        ),
+    )
+    AUDIO_DIR_MAX_BYTES: Optional[int] = Field(
+        default=None,
+        gt=0,
+        description=(
+            "Max total size of audio files kept in AUDIO_DIR when AUDIO_CACHE_CLEAN is False. "
+            "Least recently used files are deleted when this is exceeded. No limit if not set."
+        ),
+    )
+    AZURE_PREWARM: bool = Field(
+        default=False,
+        description=(
+            "If True and the default voice is an Azure voice, opens a connection to Azure "
+            "for it in the background upon startup, so the first request doesn't wait for it."
+        ),
+    )
+    PIPER_PRELOAD: bool = Field(
+        default=False,
+        description=(
+            "If True, loads the Piper model for the default voice in the background upon startup "
+            "(if it has been downloaded), so the first Piper request doesn't wait for it."
+        ),
+    )
+    OPENAI_SPLIT_SENTENCES: bool = Field(
+        default=False,
+        description=(
+            "If True, plain OpenAI texts longer than 500 characters in mp3 or pcm format are split "
+            "into sentences, which are synthesized concurrently and joined. Faster for long texts, "
+            "but prosody can differ between sentences and more requests count against rate limits."
+        ),
+    )
 
     KEYS_DIR: Path = Field(
         default=Path("keys"), description="Where to look for API keys."
@@ -153,8 +226,9 @@ class Settings(BaseSettings):
 
     def get_empty_file(self, audio_format: str) -> Path:
         """Get empty file in `AUDIO_DIR`."""
-        suffix = suffix_for_audiofmt(audio_format)
-        return self.get_audio_dir() / f"{uuid.uuid4()}.{suffix}"
+        # Inlined suffix_for_audiofmt, this runs for every synthesized file
+        suffix = _suffix_get(audio_format, FALLBACK_SUFFIX)
+        return self.get_audio_dir() / f"{_FILENAME_PREFIX}-{next(_FILENAME_COUNTER)}.{suffix}"
 
 
 # Read settings from environment
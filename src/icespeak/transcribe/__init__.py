@@ -36,8 +36,6 @@ from re import Match
 
 from islenska.basics import ALL_CASES, ALL_GENDERS, ALL_NUMBERS
 from pydantic import BaseModel, Field
-from reynir import Greynir
-from reynir.bindb import GreynirBin
 from tokenizer import TOK, Abbreviations, Tok, detokenize, tokenize
 from tokenizer.definitions import (
     CURRENCY_SYMBOLS,
@@ -69,8 +67,9 @@ from .num import (
 )
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable, Mapping
+    from collections.abc import Iterable, Iterator, Mapping
 
+    from reynir import Greynir
     from reynir.simpletree import SimpleTree
 
 # Ensure abbreviations have been loaded
@@ -78,9 +77,15 @@ Abbreviations.initialize()
 _LOG = getLogger(__name__)
 
 
+_MARKUP_SUB = re.compile(r"<.*?>").sub
+
+
 def strip_markup(text: str) -> str:
     """Remove HTML/SSML tags from a string."""
-    return re.sub(r"<.*?>", "", text)
+    if "<" not in text:
+        # No tags, skip regex substitution
+        return text
+    return _MARKUP_SUB("", text)
 
 
 class TranscriptionOptions(BaseModel):
@@ -511,6 +516,26 @@ def _split_substring_types(t: str) -> Iterable[str]:
     return ("".join(g) for _, g in itertools.groupby(t, key=chartype2val))
 
 
+class _SpellTable(dict[int, str]):
+    """
+    Translation table for `str.translate`, mapping each character
+    to its pronunciation followed by a separator.
+    Pronunciations are computed (and memoized) on first encounter,
+    so spelling a string is a single C-level `translate` call.
+    """
+
+    __slots__ = ("_pronounce", "_sep")
+
+    def __init__(self, pronounce: Callable[[str], str], sep: str) -> None:
+        super().__init__()
+        self._pronounce = pronounce
+        self._sep = sep
+
+    def __missing__(self, o: int) -> str:
+        v = self[o] = self._pronounce(chr(o)) + self._sep
+        return v
+
+
 # Matches letter followed by period or
 # 2-5 uppercase letters side-by-side not
 # followed by another uppercase letter
@@ -520,6 +545,7 @@ _ABBREV_RE = re.compile(rf"([{ALPHABET + ALPHABET.lower()}]\." + rf"|\b[{ALPHABE
 # Terms common in sentences which refer to results from sports
 _SPORTS_LEMMAS: frozenset[str] = frozenset(("leikur", "vinna", "tapa", "sigra"))
 _IGNORED_TOKENS = frozenset((TOK.WORD, TOK.PERSON, TOK.ENTITY, TOK.TIMESTAMP, TOK.UNKNOWN))
+_TIMESTAMP_TOKENS = frozenset((TOK.TIMESTAMPABS, TOK.TIMESTAMPREL))
 # These should not be interpreted as abbreviations
 # unless they include a period
 _IGNORED_ABBREVS = frozenset(("mið", "fim", "bandar", "mao", "próf", "tom", "mar"))
@@ -608,7 +634,10 @@ class DefaultTranscriber:
               unicode character before this function is called.
               (GreynirSSMLParser does this automatically.)
         """
-        # TODO: Optimize this
+        # Most text contains none of the symbols,
+        # substring checks are much faster than the replace calls
+        if "&" not in txt and "<" not in txt and ">" not in txt:
+            return txt
         for symb, new in cls._DANGER_SYMBOLS:
             txt = txt.replace(symb, new)
         return txt
@@ -884,6 +913,23 @@ class DefaultTranscriber:
         If literal is set, also pronounce spaces and punctuation symbols.
         """
 
+        # Each character is translated into its pronunciation followed by
+        # the separator, and the trailing separator then removed
+        # (equivalent to joining the pronunciations with the separator)
+        if text_format == "ssml":
+            sep = cls.vbreak(time=pause_length or "20ms")
+            return (
+                cls.vbreak(time="10ms")
+                + txt.translate(cls._spell_table(literal=literal, sep=sep))[: -len(sep)]
+                + cls.vbreak(time="20ms" if len(txt) > 1 else "10ms")
+            )
+        else:
+            return txt.translate(cls._spell_table(literal=literal, sep=" "))[:-1]
+
+    @classmethod
+    @lru_cache(maxsize=32)
+    def _spell_table(cls, *, literal: bool, sep: str) -> _SpellTable:
+        """Translation table for spelling with this transcriber's character pronunciations."""
         f: Callable[[str], str]
         if literal:
             # Literal spelling (spell spaces and punctuation)
@@ -891,15 +937,7 @@ class DefaultTranscriber:
         else:
             # Non-literal spelling
             f = lambda c: cls._CHAR_PRONUNCIATION.get(c.lower(), c) if not c.isspace() else ""
-        t = tuple(map(f, txt))
-        if text_format == "ssml":
-            return (
-                cls.vbreak(time="10ms")
-                + cls.vbreak(time=pause_length or "20ms").join(t)
-                + cls.vbreak(time="20ms" if len(t) > 1 else "10ms")
-            )
-        else:
-            return " ".join(t)
+        return _SpellTable(f, sep)
 
     @classmethod
     @_transcribe_method
@@ -1085,12 +1123,16 @@ class DefaultTranscriber:
     @_transcribe_method
     def entity(cls, txt: str) -> str:
         """Voicify an entity name."""
+        # Imported here, as importing reynir is slow
+        from reynir.bindb import GreynirBin
+
         parts = txt.split()
         with GreynirBin.get_db() as gbin:
             for i, p in enumerate(parts):
-                if p in cls._ENTITY_PRONUNCIATIONS:
+                pron = cls._ENTITY_PRONUNCIATIONS.get(p)
+                if pron is not None:
                     # Hardcoded pronunciation
-                    parts[i] = cls._ENTITY_PRONUNCIATIONS[p]
+                    parts[i] = pron
                     continue
                 if p.isdecimal():
                     # Number
@@ -1115,6 +1157,18 @@ class DefaultTranscriber:
                     parts[i] = cls.spell(p_nodots)
         return " ".join(parts)
 
+    @classmethod
+    def _date_token(cls, tok: Tok, term: SimpleTree | None) -> str:
+        """Handles date tokens in `parser_transcribe`."""
+        # TODO: Better handling of case for dates,
+        # accusative is common though
+        return cls.date(tok.txt, case="þf")
+
+    @classmethod
+    def _timestamp_token(cls, tok: Tok, term: SimpleTree | None) -> str:
+        """Handles timestamp tokens in `parser_transcribe`."""
+        return cls.time(cls.date(tok.txt, case="þf"))
+
     @classmethod
     @_transcribe_method
     @_bool_args("full_text")
@@ -1127,6 +1181,9 @@ class DefaultTranscriber:
         Utilizes the parser from the GreynirPackage library.
         """
         if cls._greynir is None:
+            # Imported here, as importing reynir is slow
+            from reynir import Greynir
+
             cls._greynir = Greynir(no_sentence_start=True)
         p_result = cls._greynir.parse(txt)
 
@@ -1191,6 +1248,7 @@ class DefaultTranscriber:
                 + cls.spell(tok.txt[len(num) + 1 :], text_format=text_format)
             )
 
+        date_handler, timestamp_handler = cls._date_token, cls._timestamp_token
         # Map certain terminals directly to transcription functions
         handler_map: Mapping[int, Callable[[Tok, SimpleTree | None], str]] = {
             TOK.ENTITY: lambda tok, term: cls.entity(tok.txt),
@@ -1200,14 +1258,12 @@ class DefaultTranscriber:
             TOK.HASHTAG: lambda tok, term: f"myllumerki {tok.txt[1:]}",
             TOK.TIME: lambda tok, term: cls.time(tok.txt),
             TOK.YEAR: lambda tok, term: cls.years(tok.txt),
-            # TODO: Better handling of case for dates,
-            # accusative is common though
-            TOK.DATE: lambda tok, term: cls.date(tok.txt, case="þf"),
-            TOK.DATEABS: lambda tok, term: cls.date(tok.txt, case="þf"),
-            TOK.DATEREL: lambda tok, term: cls.date(tok.txt, case="þf"),
-            TOK.TIMESTAMP: lambda tok, term: cls.time(cls.date(tok.txt, case="þf")),
-            TOK.TIMESTAMPABS: lambda tok, term: cls.time(cls.date(tok.txt, case="þf")),
-            TOK.TIMESTAMPREL: lambda tok, term: cls.time(cls.date(tok.txt, case="þf")),
+            TOK.DATE: date_handler,
+            TOK.DATEABS: date_handler,
+            TOK.DATEREL: date_handler,
+            TOK.TIMESTAMP: timestamp_handler,
+            TOK.TIMESTAMPABS: timestamp_handler,
+            TOK.TIMESTAMPREL: timestamp_handler,
             TOK.SSN: lambda tok, term: cls.digits(tok.txt),
             TOK.TELNO: lambda tok, term: cls.digits(tok.txt),
             TOK.SERIALNUMBER: lambda tok, term: cls.digits(tok.txt),
@@ -1286,6 +1342,9 @@ class DefaultTranscriber:
     @_transcribe_method
     def person(cls, txt: str) -> str:
         """Voicify the name of a person."""
+        # Imported here, as importing reynir is slow
+        from reynir.bindb import GreynirBin
+
         with GreynirBin.get_db() as gbin:
             gender = cast(GenderType, gbin.lookup_name_gender(txt))
         parts = txt.split()
@@ -1354,162 +1413,164 @@ class DefaultTranscriber:
         Utilizes the tokenizer library.
         """
         opt: TranscriptionOptions = options if options else TranscriptionOptions()
-        tokens: list[Tok] = list(tokenize(text))
-        for token in tokens:
-            # Check if abbreviation
-            if (
-                token.kind == TOK.WORD
-                and (meanings := Abbreviations.get_meaning(token.txt))
-                and meanings[0].fl != "erl"
-                and token.txt not in _IGNORED_ABBREVS
-            ):
-                # Expand abbreviation
-                token.txt = meanings[0].stofn
-
-            elif token.kind in _IGNORED_TOKENS:
-                continue
-
-            elif token.kind == TOK.PUNCTUATION:
-                if token.txt == "-":
-                    token.txt = "bandstrik"
-
-            # NUMBERS/ORDINALS
-            # Experimental, these don't always give
-            # better results than no transcription
-            elif token.kind == TOK.NUMBER and opt.numbers:
-                token.txt = cls.float(token.number, case="nf", gender="hk")
-
-            elif token.kind == TOK.ORDINAL and opt.ordinals:
-                token.txt = cls.ordinal(token.ordinal, case="þf", gender="kk")
-
-            # DATE/TIME
-
-            elif token.kind == TOK.TIME:
-                h, m, s = cast(DateTimeTuple, token.val)
-                token.txt = _time_to_text(h, m, s or None)
-
-            elif token.kind == TOK.DATE and opt.dates:
-                y, m, d = cast(DateTimeTuple, token.val)
-                token.txt = _date_to_text(
-                    year=y or None,
-                    month=m,
-                    day=d,
-                    case="þf",  # HACK: anecdotal, þf seems common in text
-                )
-
-            elif token.kind == TOK.YEAR and opt.years:
-                token.txt = cls.year(token.integer)
 
-            elif token.kind == TOK.DATEABS and opt.dates:
-                y, m, d = cast(DateTimeTuple, token.val)
-                token.txt = _date_to_text(
-                    year=y,
-                    month=m,
-                    day=d,
-                    case="þf",  # HACK: anecdotal
-                )
+        def _transcribe_tokens(tokens: Iterable[Tok]) -> Iterator[Tok]:
+            for token in tokens:
+                # Check if abbreviation
+                if (
+                    token.kind == TOK.WORD
+                    and (meanings := Abbreviations.get_meaning(token.txt))
+                    and meanings[0].fl != "erl"
+                    and token.txt not in _IGNORED_ABBREVS
+                ):
+                    # Expand abbreviation
+                    token.txt = meanings[0].stofn
+
+                elif token.kind in _IGNORED_TOKENS:
+                    pass
+
+                elif token.kind == TOK.PUNCTUATION:
+                    if token.txt == "-":
+                        token.txt = "bandstrik"
+
+                # NUMBERS/ORDINALS
+                # Experimental, these don't always give
+                # better results than no transcription
+                elif token.kind == TOK.NUMBER and opt.numbers:
+                    token.txt = cls.float(token.number, case="nf", gender="hk")
+
+                elif token.kind == TOK.ORDINAL and opt.ordinals:
+                    token.txt = cls.ordinal(token.ordinal, case="þf", gender="kk")
+
+                # DATE/TIME
+
+                elif token.kind == TOK.TIME:
+                    h, m, s = cast(DateTimeTuple, token.val)
+                    token.txt = _time_to_text(h, m, s or None)
+
+                elif token.kind == TOK.DATE and opt.dates:
+                    y, m, d = cast(DateTimeTuple, token.val)
+                    token.txt = _date_to_text(
+                        year=y or None,
+                        month=m,
+                        day=d,
+                        case="þf",  # HACK: anecdotal, þf seems common in text
+                    )
 
-            elif token.kind == TOK.DATEREL and opt.dates:
-                y, m, d = cast(DateTimeTuple, token.val)
-                token.txt = _date_to_text(
-                    year=y or None,
-                    month=m,
-                    day=d or None,
-                    case="þf",  # HACK: anecdotal
-                )
+                elif token.kind == TOK.YEAR and opt.years:
+                    token.txt = cls.year(token.integer)
 
-            elif token.kind == TOK.TIMESTAMPABS and opt.dates:
-                token.txt = cls.time(cls.date(token.txt, case="þf"))  # HACK: anecdotal
+                elif token.kind == TOK.DATEABS and opt.dates:
+                    y, m, d = cast(DateTimeTuple, token.val)
+                    token.txt = _date_to_text(
+                        year=y,
+                        month=m,
+                        day=d,
+                        case="þf",  # HACK: anecdotal
+                    )
 
-            elif token.kind == TOK.TIMESTAMPREL and opt.dates:
-                token.txt = cls.time(cls.date(token.txt, case="þf"))  # HACK: anecdotal
+                elif token.kind == TOK.DATEREL and opt.dates:
+                    y, m, d = cast(DateTimeTuple, token.val)
+                    token.txt = _date_to_text(
+                        year=y or None,
+                        month=m,
+                        day=d or None,
+                        case="þf",  # HACK: anecdotal
+                    )
 
-            # COMMUNICATION/INTERNET
+                elif token.kind in _TIMESTAMP_TOKENS and opt.dates:
+                    token.txt = cls.time(cls.date(token.txt, case="þf"))  # HACK: anecdotal
 
-            elif token.kind == TOK.TELNO:
-                token.txt = cls.phone(token.txt)
+                # COMMUNICATION/INTERNET
 
-            elif token.kind == TOK.EMAIL and opt.emails:
-                token.txt = cls.email(token.txt)
+                elif token.kind == TOK.TELNO:
+                    token.txt = cls.phone(token.txt)
 
-            elif token.kind == TOK.DOMAIN and opt.domains:
-                token.txt = cls.domain(token.txt)
+                elif token.kind == TOK.EMAIL and opt.emails:
+                    token.txt = cls.email(token.txt)
 
-            elif token.kind == TOK.URL and opt.urls:
-                protocol, _, domain = token.txt.partition("://")
-                if domain:
-                    token.txt = cls.spell(protocol) + cls.domain(domain)
+                elif token.kind == TOK.DOMAIN and opt.domains:
+                    token.txt = cls.domain(token.txt)
 
-            elif token.kind == TOK.HASHTAG:
-                token.txt = "myllumerki " + token.txt.lstrip("#")
+                elif token.kind == TOK.URL and opt.urls:
+                    protocol, _, domain = token.txt.partition("://")
+                    if domain:
+                        token.txt = cls.spell(protocol) + cls.domain(domain)
 
-            elif token.kind == TOK.USERNAME:
-                token.txt = cls.username(token.txt)
+                elif token.kind == TOK.HASHTAG:
+                    token.txt = "myllumerki " + token.txt.lstrip("#")
 
-            # CURRENCY/BUSINESS
+                elif token.kind == TOK.USERNAME:
+                    token.txt = cls.username(token.txt)
 
-            elif token.kind == TOK.CURRENCY:
-                curr, _, _ = cast(CurrencyTuple, token.val)
-                token.txt = cls.currency(curr)
+                # CURRENCY/BUSINESS
 
-            elif token.kind == TOK.AMOUNT and opt.amounts:
-                num, curr, _, _ = cast(AmountTuple, token.val)
-                curr = CURRENCY_SYMBOLS.get(curr, curr)
-                token.txt = (
-                    cls.float(num, case="nf", gender=_currency_to_gender(curr))
-                    + " "
-                    + cls.currency(curr, number="ft" if _is_plural(num) else "et")
-                )
+                elif token.kind == TOK.CURRENCY:
+                    curr, _, _ = cast(CurrencyTuple, token.val)
+                    token.txt = cls.currency(curr)
 
-            elif token.kind == TOK.COMPANY:
-                token.txt = cls.entity(token.txt)
+                elif token.kind == TOK.AMOUNT and opt.amounts:
+                    num, curr, _, _ = cast(AmountTuple, token.val)
+                    curr = CURRENCY_SYMBOLS.get(curr, curr)
+                    token.txt = (
+                        cls.float(num, case="nf", gender=_currency_to_gender(curr))
+                        + " "
+                        + cls.currency(curr, number="ft" if _is_plural(num) else "et")
+                    )
 
-            # SCIENCE
+                elif token.kind == TOK.COMPANY:
+                    token.txt = cls.entity(token.txt)
+
+                # SCIENCE
+
+                elif token.kind == TOK.PERCENT and opt.percentages:
+                    percent, _, _ = cast(NumberTuple, token.val)
+                    if "%" in token.txt:
+                        token.txt = cls.float(percent, case="nf", gender="hk") + " prósent"
+                    elif "‰" in token.txt:
+                        token.txt = cls.float(percent, case="nf", gender="hk") + " prómill"
+                    else:
+                        # Probably written form (e.g. '3,5 prósent'), only transcribe the number
+                        token.txt = cls.floats(token.txt, case="nf", gender="hk")
+
+                elif token.kind == TOK.MEASUREMENT and opt.measurements:
+                    # We can't use token.val here because
+                    # the tokenization converts everything to SI units
+                    # unit, num = cast(MeasurementTuple, token.val)
+
+                    # HACK: Deal correctly with messes such as "-1.234,56km"
+                    i = 0
+                    while i < len(token.txt):
+                        c = token.txt[i]
+                        if not (c.isdecimal() or c in "+-,. "):
+                            break
+                        i += 1
+                    num = float(token.txt[:i].replace(".", "").replace(",", "."))
+                    unit = token.txt[i:]
+
+                    token.txt = (
+                        cls.float(num, case="nf", gender=_unit_to_gender(unit))
+                        + " "
+                        + cls.unit(unit, number="ft" if _is_plural(num) else "et")
+                    )
 
-            elif token.kind == TOK.PERCENT and opt.percentages:
-                percent, _, _ = cast(NumberTuple, token.val)
-                if "%" in token.txt:
-                    token.txt = cls.float(percent, case="nf", gender="hk") + " prósent"
-                elif "‰" in token.txt:
-                    token.txt = cls.float(percent, case="nf", gender="hk") + " prómill"
-                else:
-                    # Probably written form (e.g. '3,5 prósent'), only transcribe the number
-                    token.txt = cls.floats(token.txt, case="nf", gender="hk")
-
-            elif token.kind == TOK.MEASUREMENT and opt.measurements:
-                # We can't use token.val here because
-                # the tokenization converts everything to SI units
-                # unit, num = cast(MeasurementTuple, token.val)
-
-                # HACK: Deal correctly with messes such as "-1.234,56km"
-                i = 0
-                while i < len(token.txt):
-                    c = token.txt[i]
-                    if not (c.isdecimal() or c in "+-,. "):
-                        break
-                    i += 1
-                num = float(token.txt[:i].replace(".", "").replace(",", "."))
-                unit = token.txt[i:]
-
-                token.txt = (
-                    cls.float(num, case="nf", gender=_unit_to_gender(unit))
-                    + " "
-                    + cls.unit(unit, number="ft" if _is_plural(num) else "et")
-                )
+                elif token.kind == TOK.MOLECULE:
+                    token.txt = cls.molecule(token.txt)
 
-            elif token.kind == TOK.MOLECULE:
-                token.txt = cls.molecule(token.txt)
+                # MISC
 
-            # MISC
+                elif token.kind == TOK.NUMWLETTER:
+                    num, letter = cast(PunctuationTuple, token.val)
+                    token.txt = cls.number(num, case="nf", gender="hk") + " " + cls.spell(letter)
 
-            elif token.kind == TOK.NUMWLETTER:
-                num, letter = cast(PunctuationTuple, token.val)
-                token.txt = cls.number(num, case="nf", gender="hk") + " " + cls.spell(letter)
+                elif token.kind == TOK.SSN:
+                    token.txt = cls.digits(token.txt)
 
-            elif token.kind == TOK.SSN:
-                token.txt = cls.digits(token.txt)
+                elif token.kind == TOK.SERIALNUMBER:
+                    token.txt = cls.digits(token.txt)
 
-            elif token.kind == TOK.SERIALNUMBER:
-                token.txt = cls.digits(token.txt)
+                yield token
 
-        return detokenize(tokens)
+        # Tokens are transcribed one at a time as detokenize consumes them,
+        # no intermediate list of tokens is built
+        return detokenize(_transcribe_tokens(tokenize(text)))
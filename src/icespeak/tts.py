@@ -24,25 +24,34 @@ This file contains wrappers for the entire text-to-speech pipeline
 
 from __future__ import annotations
 
-from collections.abc import Mapping
+from collections.abc import Iterable, Mapping
 from typing import TYPE_CHECKING, Any, NamedTuple, TypeVar
 from typing_extensions import override
 
+import asyncio
 import atexit
+import hashlib
+import os
 import queue
+import re
 import threading
-from logging import DEBUG, getLogger
+from collections import OrderedDict
+from concurrent.futures import Future
+from logging import getLogger
 
-from cachetools import LFUCache, cached
+from cachetools import LFUCache
+from cachetools.keys import hashkey
 
-from .settings import SETTINGS, TRACE, Keys
-from .transcribe import TranscriptionOptions
+from .settings import SETTINGS, TRACE, Keys, TextFormats, suffix_for_audiofmt
+from .transcribe import TranscriptionOptions, strip_markup
 
-from .voices import BaseVoice, TTSOptions, VoiceInfoT, aws_polly, azure, openai, piper_tts
+from .voices import BATCH_MAX_WORKERS, BaseVoice, TTSOptions, VoiceInfoT, aws_polly, azure, openai, piper_tts
 
 if TYPE_CHECKING:
     from pathlib import Path
 
+    from pydantic import BaseModel
+
 _LOG = getLogger(__name__)
 VoicesT = Mapping[str, VoiceInfoT]
 ServicesT = Mapping[str, BaseVoice]
@@ -53,7 +62,7 @@ class TTSOutput(NamedTuple):
     text: str
 
 
-def _setup_voices() -> tuple[VoicesT, ServicesT]:
+def _setup_voices() -> tuple[VoicesT, ServicesT, ServicesT]:
     services = (
         aws_polly.AWSPollyVoice(),
         azure.AzureVoice(),
@@ -61,6 +70,8 @@ def _setup_voices() -> tuple[VoicesT, ServicesT]:
         piper_tts.PiperTTSVoice(),
     )
     voices: VoicesT = {}
+    # Voice name -> service instance, so TTS calls need only a single lookup
+    voice_to_service: dict[str, BaseVoice] = {}
     for service in services:
         _LOG.debug("Loading voices from service: %s", service)
         if not service.available:
@@ -77,10 +88,11 @@ def _setup_voices() -> tuple[VoicesT, ServicesT]:
                 )
             else:
                 voices[voice] = {"service": service.name, **info}
-    return voices, {k.name: k for k in services}
+                voice_to_service[voice] = service
+    return voices, {k.name: k for k in services}, voice_to_service
 
 
-VOICES, SERVICES = _setup_voices()
+VOICES, SERVICES, VOICE_TO_SERVICE = _setup_voices()
 
 
 _T = TypeVar("_T")
@@ -91,6 +103,8 @@ class TmpFileLFUCache(LFUCache[_T, TTSOutput]):
     Custom version of a least-frequently-used cache which,
     if the clean cache setting is True,
     schedules files for deletion upon eviction from the cache.
+    LFUCache keeps keys in per-frequency linked buckets
+    (cachetools>=6.1), so lookups and evictions are O(1).
     See docs:
     https://cachetools.readthedocs.io/en/latest/#extending-cache-classes
     """
@@ -102,20 +116,71 @@ class TmpFileLFUCache(LFUCache[_T, TTSOutput]):
         _LOG.debug("Expired audio file: %s", audiofile)
         # Schedule for deletion, if cleaning the cache
         if SETTINGS.AUDIO_CACHE_CLEAN:
-            _EXPIRED_QUEUE.put(audiofile.file)
+            _EXPIRED_QUEUE.put(os.fspath(audiofile.file))
         return key, audiofile
 
 
 _AUDIO_CACHE: TmpFileLFUCache[Any] = TmpFileLFUCache(maxsize=SETTINGS.AUDIO_CACHE_SIZE)
+_AUDIO_CACHE_LOCK = threading.Lock()
+# Cache key -> result of a synthesis currently in progress
+# (guarded by _AUDIO_CACHE_LOCK)
+_IN_FLIGHT: dict[Any, Future[TTSOutput]] = {}
+# Generated audio files which aren't in the audio cache (oldest first),
+# deleted upon exit along with cached files if cleaning the cache.
+# If SETTINGS.AUDIO_MAX_UNCACHED_FILES is set, only that many of the newest
+# are kept, so a long-running process doesn't accumulate files
+# (guarded by _AUDIO_CACHE_LOCK)
+_UNCACHED_FILES: OrderedDict[str, None] = OrderedDict()
+
+
+def _add_uncached_locked(audiofile: str) -> None:
+    """Track an uncached audio file, scheduling the oldest ones for deletion if over the limit."""
+    _UNCACHED_FILES[audiofile] = None
+    max_files = SETTINGS.AUDIO_MAX_UNCACHED_FILES
+    while max_files is not None and len(_UNCACHED_FILES) > max_files:
+        expired, _ = _UNCACHED_FILES.popitem(last=False)
+        _LOG.debug("Expired uncached audio file: %s", expired)
+        _EXPIRED_QUEUE.put(expired)
+
+
+def _track_uncached(output: TTSOutput) -> TTSOutput:
+    """Schedule an audio file which bypassed the cache for deletion."""
+    if SETTINGS.AUDIO_CACHE_CLEAN:
+        with _AUDIO_CACHE_LOCK:
+            _add_uncached_locked(os.fspath(output.file))
+    return output
+
 
 # Cleanup functionality, if cleaning cache setting is turned on
 if SETTINGS.AUDIO_CACHE_CLEAN:
-    _EXPIRED_QUEUE: queue.Queue[Path | None] = queue.Queue()
+    _EXPIRED_QUEUE: queue.SimpleQueue[str | None] = queue.SimpleQueue()
+
+    def _unlink(audiofile: str) -> None:
+        _LOG.log(TRACE, "Unlinking file: %s", audiofile)
+        try:
+            os.unlink(audiofile)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            _LOG.debug("Could not unlink file: %s", audiofile, exc_info=True)
 
     def _cleanup():
-        while audiofile := _EXPIRED_QUEUE.get():
-            _LOG.log(TRACE, "Unlinking file: %s", audiofile)
-            audiofile.unlink(missing_ok=True)
+        stop = False
+        while not stop:
+            batch = [_EXPIRED_QUEUE.get()]
+            # Drain anything else queued in the meantime,
+            # so a burst of evictions is deleted in one pass
+            try:
+                while True:
+                    batch.append(_EXPIRED_QUEUE.get_nowait())
+            except queue.Empty:
+                pass
+            for audiofile in batch:
+                if audiofile is None:
+                    # Signal to stop, after deleting the rest of the batch
+                    stop = True
+                else:
+                    _unlink(audiofile)
 
     # Small daemon thread which deletes files sent to the expired queue
     _cleanup_thread = threading.Thread(
@@ -123,15 +188,45 @@ if SETTINGS.AUDIO_CACHE_CLEAN:
     )
     _cleanup_thread.start()
 
+    # Unlink files in parallel upon exit if there are at least this many
+    _EVICT_PARALLEL_MIN = 32
+    # Number of threads unlinking files in parallel upon exit
+    _EVICT_WORKERS = 32
+
+    def _unlink_many(audiofiles: list[str]) -> None:
+        for audiofile in audiofiles:
+            _unlink(audiofile)
+
     def _evict_all():
         _LOG.debug("Evicting everything from cache...")
         _EXPIRED_QUEUE.put(None)  # Signal to thread to stop
         try:
-            while _AUDIO_CACHE.currsize > 0:
-                # Remove all files currently in cache
-                _, v = _AUDIO_CACHE.popitem()
-                _LOG.log(TRACE, "Unlinking file: %s", v.file)
-                v.file.unlink(missing_ok=True)
+            with _AUDIO_CACHE_LOCK:
+                # Collect all files currently in cache, along with uncached files
+                audiofiles = [os.fspath(v.file) for v in _AUDIO_CACHE.values()]
+                audiofiles.extend(_UNCACHED_FILES)
+            if len(audiofiles) < _EVICT_PARALLEL_MIN:
+                _unlink_many(audiofiles)
+            else:
+                # os.unlink releases the GIL, so deleting many files
+                # from several threads speeds up exit
+                # (concurrent.futures refuses new work during interpreter shutdown,
+                # so plain threads are used here)
+                shards = [audiofiles[i::_EVICT_WORKERS] for i in range(_EVICT_WORKERS)]
+                workers: list[threading.Thread] = []
+                for i, shard in enumerate(shards):
+                    w = threading.Thread(target=_unlink_many, args=(shard,), daemon=True)
+                    try:
+                        w.start()
+                    except RuntimeError:
+                        # Python 3.12+ refuses to start threads during
+                        # interpreter shutdown, unlink the rest here instead
+                        for rest in shards[i:]:
+                            _unlink_many(rest)
+                        break
+                    workers.append(w)
+                for w in workers:
+                    w.join()
         except Exception:
             _LOG.exception("Error when cleaning cache.")
         # Give the thread a little bit of time to join,
@@ -143,7 +238,6 @@ if SETTINGS.AUDIO_CACHE_CLEAN:
     atexit.register(_evict_all)
 
 
-# @cached(_AUDIO_CACHE)
 def tts_to_file(
     text: str,
     tts_options: TTSOptions | None = None,
@@ -163,42 +257,248 @@ def tts_to_file(
 
     Returns a named tuple containing a path to the output audio file,
     along with the text that was sent to the TTS service.
+
+    If `SETTINGS.AUDIO_CACHE_ENABLED` is set, results are cached
+    (except for untranscribed text longer than `SETTINGS.AUDIO_CACHE_MAX_KEY_LEN`,
+    which is unlikely to recur and expensive to hash)
+    and concurrent identical requests share a single synthesis.
+    The returned file is then shared with other callers, so it shouldn't be
+    modified or deleted, and if `SETTINGS.AUDIO_CACHE_CLEAN` is set
+    it is deleted once evicted from the cache.
+    Files which aren't cached are deleted upon exit (if `SETTINGS.AUDIO_CACHE_CLEAN` is set),
+    or, if `SETTINGS.AUDIO_MAX_UNCACHED_FILES` is set,
+    once that many newer uncached files have been generated.
+
+    Raises `ValueError` for empty or whitespace-only text
+    (after removing markup, unless the text is SSML) and invalid options.
     """
-    if _LOG.isEnabledFor(DEBUG):
-        _LOG.debug(
-            "tts_to_file, text: %r, TTS options: %s, "
-            + "transcribe: %r, transcription options: %s",
-            text,
-            (
-                tts_options.model_dump(exclude_defaults=True) or "<default>"
-                if tts_options
-                else "None"
-            ),
-            transcribe,
-            (
-                transcription_options.model_dump(exclude_defaults=True) or "<default>"
-                if transcription_options
-                else "None"
-            ),
-        )
     tts_options = tts_options or TTSOptions()
+    if (
+        not text
+        or text.isspace()
+        or ("<" in text and tts_options.text_format is not TextFormats.SSML and not strip_markup(text).strip())
+    ):
+        # Don't pay for a round trip to the TTS service to synthesize silence
+        # (markup is removed from non-SSML text before it's sent)
+        raise ValueError("No text to synthesize.")
+
+    # Validate options before computing the cache key,
+    # so invalid requests fail without hashing (possibly long) text
     try:
-        service = SERVICES[VOICES[tts_options.voice]["service"]]
+        service = VOICE_TO_SERVICE[tts_options.voice]
     except KeyError as e:
         raise ValueError(f"Voice {tts_options.voice!r} not available.") from e
-
     if tts_options.audio_format not in service.audio_formats:
         raise ValueError(
             f"Service {service.name} doesn't support audio format {tts_options.audio_format}."
         )
 
+    if not SETTINGS.AUDIO_CACHE_ENABLED or (not transcribe and len(text) > SETTINGS.AUDIO_CACHE_MAX_KEY_LEN):
+        return _track_uncached(
+            _do_tts(
+                service, text, tts_options, transcription_options, transcribe=transcribe, keys_override=keys_override
+            )
+        )
+
+    # Key on a fixed-size digest of the text, so cache keys
+    # don't keep the full text alive or compare it on lookup
+    digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    # (Audio doesn't depend on the API keys used, so they aren't part of the key)
+    key = hashkey(digest, tts_options, transcription_options, transcribe=transcribe)
+    with _AUDIO_CACHE_LOCK:
+        output = _AUDIO_CACHE.get(key)
+        if output is not None and (
+            SETTINGS.AUDIO_CACHE_CLEAN or SETTINGS.AUDIO_DIR_MAX_BYTES is None or output.file.is_file()
+        ):
+            # (Kept audio files might have been trimmed from the audio directory)
+            return output
+        # If an identical request is already being synthesized,
+        # wait for its result instead of calling the TTS service again
+        future = _IN_FLIGHT.get(key)
+        owner = future is None
+        if future is None:
+            future = _IN_FLIGHT[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        output = _do_tts(
+            service, text, tts_options, transcription_options, transcribe=transcribe, keys_override=keys_override
+        )
+    except BaseException as e:
+        with _AUDIO_CACHE_LOCK:
+            del _IN_FLIGHT[key]
+        future.set_exception(e)
+        raise
+    with _AUDIO_CACHE_LOCK:
+        del _IN_FLIGHT[key]
+        try:
+            _AUDIO_CACHE[key] = output
+        except ValueError:
+            # Value too large for cache (e.g. cache size is 0)
+            if SETTINGS.AUDIO_CACHE_CLEAN:
+                _add_uncached_locked(os.fspath(output.file))
+    future.set_result(output)
+    return output
+
+
+async def tts_to_files_async(
+    texts: Iterable[str],
+    tts_options: TTSOptions | None = None,
+    transcription_options: TranscriptionOptions | None = None,
+    *,
+    transcribe: bool = True,
+    keys_override: Keys | None = None,
+    max_concurrency: int = BATCH_MAX_WORKERS,
+) -> list[TTSOutput]:
+    """
+    Asynchronous bulk version of `tts_to_file`.
+
+    Synthesizes several texts concurrently in worker threads,
+    with at most `max_concurrency` requests in flight at once
+    (to stay within the rate limits of the TTS services).
+    Identical texts are only synthesized once.
+
+    Returns a list of outputs, in the same order as `texts`.
+    Raises `ValueError` if `max_concurrency` is less than 1.
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, not {max_concurrency}.")
+    texts = list(texts)
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def _one(text: str) -> TTSOutput:
+        async with sem:
+            return await asyncio.to_thread(
+                tts_to_file,
+                text,
+                tts_options,
+                transcription_options,
+                transcribe=transcribe,
+                keys_override=keys_override,
+            )
+
+    unique = list(dict.fromkeys(texts))
+    outputs = dict(zip(unique, await asyncio.gather(*map(_one, unique))))
+    return [outputs[text] for text in texts]
+
+
+class _LazyDump:
+    """Formats options for logging, only if the log record is actually emitted."""
+
+    __slots__ = ("opts",)
+
+    def __init__(self, opts: BaseModel | None) -> None:
+        self.opts = opts
+
+    @override
+    def __str__(self) -> str:
+        if self.opts is None:
+            return "None"
+        return str(self.opts.model_dump(exclude_defaults=True) or "<default>")
+
+
+def _do_tts(
+    service: BaseVoice,
+    text: str,
+    tts_options: TTSOptions,
+    transcription_options: TranscriptionOptions | None,
+    *,
+    transcribe: bool,
+    keys_override: Keys | None,
+) -> TTSOutput:
+    """Uncached text-to-speech with validated options, see `tts_to_file`."""
+    _LOG.debug(
+        "tts_to_file, text: %r, TTS options: %s, "
+        + "transcribe: %r, transcription options: %s",
+        text,
+        _LazyDump(tts_options),
+        transcribe,
+        _LazyDump(transcription_options),
+    )
+
     if transcribe:
         transcription_options = transcription_options or TranscriptionOptions()
         text = service.Transcriber.token_transcribe(text, options=transcription_options)
 
-    output = TTSOutput(
-        file=service.text_to_speech(text, tts_options, keys_override),
-        text=text,
-    )
+    if SETTINGS.AUDIO_CACHE_CLEAN:
+        file = service.text_to_speech(text, tts_options, keys_override)
+    else:
+        file = _persistent_tts(service, text, tts_options, keys_override)
+    output = TTSOutput(file=file, text=text)
     _LOG.debug("tts_to_file, out: %s", output)
     return output
+
+
+def _persistent_tts(service: BaseVoice, text: str, tts_options: TTSOptions, keys_override: Keys | None) -> Path:
+    """
+    Text-to-speech into a content-addressed file in the audio directory,
+    used when audio files are kept after exit.
+    Identical requests (even across restarts) reuse the existing file.
+    """
+    h = hashlib.blake2b(tts_options.model_dump_json().encode(), digest_size=16)
+    h.update(b"\0")
+    h.update(text.encode("utf-8", "surrogatepass"))
+    outfile = SETTINGS.get_audio_dir() / f"{h.hexdigest()}.{suffix_for_audiofmt(tts_options.audio_format)}"
+    if outfile.is_file():
+        _LOG.debug("Reusing existing audio file: %s", outfile)
+        if SETTINGS.AUDIO_DIR_MAX_BYTES is not None:
+            # Mark file as recently used
+            os.utime(outfile)
+        return outfile
+
+    file = service.text_to_speech(text, tts_options, keys_override)
+    # Atomic rename, so a partially written file is never reused
+    os.replace(file, outfile)
+    if SETTINGS.AUDIO_DIR_MAX_BYTES is not None:
+        _add_kept_audio(outfile)
+    return outfile
+
+
+# Name of content-addressed audio files, see _persistent_tts
+_KEPT_AUDIO_NAME_RE = re.compile(r"[0-9a-f]{32}\.\w+")
+_KEPT_AUDIO_LOCK = threading.Lock()
+# Total size of kept audio files (bytes), computed on first use
+_kept_audio_size: int | None = None
+
+
+def _kept_audio_files() -> list[os.DirEntry[str]]:
+    with os.scandir(SETTINGS.get_audio_dir()) as it:
+        return [e for e in it if _KEPT_AUDIO_NAME_RE.fullmatch(e.name) and e.is_file()]
+
+
+def _add_kept_audio(new_file: Path) -> None:
+    """
+    Account for a new kept audio file, deleting the least recently used
+    other kept files if their total size exceeds `SETTINGS.AUDIO_DIR_MAX_BYTES`.
+    The new file itself is never deleted, even if it alone exceeds the limit.
+    """
+    global _kept_audio_size
+    max_bytes = SETTINGS.AUDIO_DIR_MAX_BYTES
+    assert max_bytes is not None
+    with _KEPT_AUDIO_LOCK:
+        if _kept_audio_size is None:
+            # First new file, scan directory (already includes the new file)
+            _kept_audio_size = sum(e.stat().st_size for e in _kept_audio_files())
+        else:
+            _kept_audio_size += new_file.stat().st_size
+        if _kept_audio_size <= max_bytes:
+            return
+
+        # Rescan, as other processes might share the audio directory
+        files = [(e.stat(), e.path) for e in _kept_audio_files()]
+        _kept_audio_size = sum(st.st_size for st, _ in files)
+        # Trim to 90% of the limit, so this doesn't happen for every new file
+        target = max_bytes * 0.9
+        new_path = os.fspath(new_file)
+        for st, path in sorted(files, key=lambda f: f[0].st_mtime):
+            if _kept_audio_size <= target:
+                break
+            if path == new_path:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            _kept_audio_size -= st.st_size
+        _LOG.debug("Trimmed kept audio files, total size now %d bytes", _kept_audio_size)
@@ -21,10 +21,13 @@ along with this program.  If not, see http://www.gnu.org/licenses/.
 
 from __future__ import annotations
 
-from collections.abc import Collection, Mapping
+from collections.abc import Collection, Iterable, Mapping
 from typing import TYPE_CHECKING, TypedDict
 
+import asyncio
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from logging import getLogger
 
 from pydantic import BaseModel, Field
@@ -39,6 +42,10 @@ if TYPE_CHECKING:
 
 _LOG = getLogger(__name__)
 
+# Max number of concurrent requests in `BaseVoice.batch_text_to_speech`
+# (kept below the size of the Polly client's connection pool)
+BATCH_MAX_WORKERS = 8
+
 
 class VoiceInfoT(TypedDict):
     id: str
@@ -60,6 +67,8 @@ class TTSOptions(BaseModel):
         default=SETTINGS.DEFAULT_VOICE_SPEED,
         ge=MIN_SPEED,
         le=MAX_SPEED,
+        # NaN passes both range checks, reject it explicitly
+        allow_inf_nan=False,
         description="TTS speed.",
     )
     text_format: TextFormats = Field(
@@ -126,3 +135,25 @@ class BaseVoice(ABC):
     @abstractmethod
     def text_to_speech(self, text: str, options: TTSOptions, keys_override: Keys | None = None) -> Path:
         raise NotImplementedError
+
+    async def text_to_speech_async(self, text: str, options: TTSOptions, keys_override: Keys | None = None) -> Path:
+        """
+        Asynchronous version of `text_to_speech`.
+        Runs the (network bound) synthesis in a worker thread,
+        so many requests can be awaited concurrently.
+        """
+        return await asyncio.to_thread(self.text_to_speech, text, options, keys_override)
+
+    def batch_text_to_speech(
+        self, texts: Iterable[str], options: TTSOptions, keys_override: Keys | None = None
+    ) -> list[Path]:
+        """
+        Synthesize speech for several texts concurrently,
+        overlapping the network round trips of the individual requests.
+        Returns a list of output files, in the same order as `texts`.
+        """
+        texts = list(texts)
+        if len(texts) <= 1:
+            return [self.text_to_speech(text, options, keys_override) for text in texts]
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(texts))) as executor:
+            return list(executor.map(self.text_to_speech, texts, repeat(options), repeat(keys_override)))
@@ -26,36 +26,64 @@ from __future__ import annotations
 from typing import Any
 from typing_extensions import override
 
+import shutil
+from functools import cache, lru_cache
 from logging import getLogger
-from threading import Lock
 
-import boto3
-
-from icespeak.settings import API_KEYS, SETTINGS, AWSPollyKey, Keys
+from icespeak.settings import API_KEYS, SETTINGS, AWSPollyKey, Keys, TextFormats
 
 from . import BaseVoice, ModuleAudioFormatsT, ModuleVoicesT, TTSOptions
 
 _LOG = getLogger(__name__)
 
 
+def _create_client(aws_key: AWSPollyKey) -> Any:
+    # Imported here, as importing boto3 is slow
+    # and not needed unless this service is used
+    import boto3
+    from botocore.config import Config
+
+    # Allow plenty of pooled connections, as the default client is shared
+    # between threads, e.g. by several concurrent batches
+    config_args: dict[str, Any] = {
+        "max_pool_connections": 32,
+        "retries": {"mode": "standard", "max_attempts": 3},
+    }
+    if "tcp_keepalive" in Config.OPTION_DEFAULTS:
+        # Keep idle connections warm (not supported by older botocore versions)
+        config_args["tcp_keepalive"] = True
+    # A separate session per client, as boto3's default session isn't thread safe
+    return boto3.session.Session().client(
+        "polly",
+        config=Config(**config_args),
+        region_name=aws_key.region_name.get_secret_value(),
+        aws_access_key_id=aws_key.aws_access_key_id.get_secret_value(),
+        aws_secret_access_key=aws_key.aws_secret_access_key.get_secret_value(),
+    )
+
+
+# Clients for overridden keys, so repeated overrides reuse
+# a client (and its connection pool) instead of creating a new one per call
+_override_client = lru_cache(maxsize=8)(_create_client)
+
+
+@cache
+def _default_client() -> Any:
+    """Return client using the default AWS keys, created on first use."""
+    assert API_KEYS.aws, "AWS Polly API key missing."
+    return _create_client(API_KEYS.aws)
+
+
 class AWSPollyVoice(BaseVoice):
     _NAME: str = "AWS Polly"
     _VOICES: ModuleVoicesT = {
         "Karl": {"id": "Karl", "lang": "is-IS", "style": "male"},
         "Dora": {"id": "Dora", "lang": "is-IS", "style": "female"},
     }
+    # Voice name -> (Polly voice ID, language code)
+    _VOICE_PARAMS: dict[str, tuple[str, str]] = {k: (v["id"], v["lang"]) for k, v in _VOICES.items()}
     _AUDIO_FORMATS: ModuleAudioFormatsT = frozenset(("mp3", "pcm", "ogg_vorbis"))
 
-    _lock = Lock()
-
-    def _create_client(self, aws_key: AWSPollyKey) -> boto3.client:
-        return boto3.client(
-            "polly",
-            region_name=aws_key.region_name.get_secret_value(),
-            aws_access_key_id=aws_key.aws_access_key_id.get_secret_value(),
-            aws_secret_access_key=aws_key.aws_secret_access_key.get_secret_value(),
-        )
-
     @property
     @override
     def name(self):
@@ -75,35 +103,31 @@ class AWSPollyVoice(BaseVoice):
     def load_api_keys(self):
         assert API_KEYS.aws, "AWS Polly API key missing."
 
-        self._aws_client: Any = None
-        with AWSPollyVoice._lock:
-            if self._aws_client is None:
-                self._aws_client = self._create_client(API_KEYS.aws)
-
     @override
     def text_to_speech(self, text: str, options: TTSOptions, keys_override: Keys | None = None):
         if keys_override and keys_override.aws:
             _LOG.debug("Using overridden AWS keys")
-            client = self._create_client(keys_override.aws)
+            client = _override_client(keys_override.aws)
         else:
             _LOG.debug("Using default AWS keys")
-            client = self._aws_client
+            client = _default_client()
         # Special preprocessing for SSML markup
-        if options.text_format == "ssml":
-            # Adjust voice speed as appropriate
+        if options.text_format is TextFormats.SSML:
+            # Adjust voice speed as appropriate and wrap text in the
+            # required <speak> tag (in one f-string, avoids copying long texts twice)
             if options.speed != 1.0:
                 perc = int(options.speed * 100)
-                text = f'<prosody rate="{perc}%">{text}</prosody>'
-            # Wrap text in the required <speak> tag
-            if not text.startswith("<speak>"):
+                text = f'<speak><prosody rate="{perc}%">{text}</prosody></speak>'
+            elif not text.startswith("<speak>"):
                 text = f"<speak>{text}</speak>"
 
         try:
+            voice_id, lang = AWSPollyVoice._VOICE_PARAMS[options.voice]
             aws_args = {
                 "Text": text,
                 "TextType": options.text_format,
-                "VoiceId": AWSPollyVoice._VOICES[options.voice]["id"],
-                "LanguageCode": AWSPollyVoice._VOICES[options.voice]["lang"],
+                "VoiceId": voice_id,
+                "LanguageCode": lang,
                 "SampleRate": "16000",
                 "OutputFormat": options.audio_format,
             }
@@ -114,5 +138,7 @@ class AWSPollyVoice(BaseVoice):
             raise
 
         outfile = SETTINGS.get_empty_file(options.audio_format)
-        outfile.write_bytes(response["AudioStream"].read())
+        # Stream audio to file in chunks, rather than reading it all into memory
+        with outfile.open("wb") as f:
+            shutil.copyfileobj(response["AudioStream"], f, 1 << 16)
         return outfile
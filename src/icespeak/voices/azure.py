@@ -23,28 +23,59 @@ Icelandic-language text to speech via the Azure Speech API.
 
 from __future__ import annotations
 
+from typing import TYPE_CHECKING
 from typing_extensions import override
 
-from logging import getLogger
+from collections import defaultdict
+from functools import cache
+from logging import DEBUG, getLogger
 from ssl import OPENSSL_VERSION_INFO
+from threading import Lock, Thread
+from xml.sax.saxutils import escape
 
-import azure.cognitiveservices.speech as speechsdk
-
-from icespeak.settings import API_KEYS, SETTINGS, Keys
+from icespeak.settings import API_KEYS, SETTINGS, Keys, TextFormats
 from icespeak.transcribe import DefaultTranscriber, strip_markup
 
 from . import BaseVoice, ModuleAudioFormatsT, ModuleVoicesT, TTSOptions
 
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from types import ModuleType
+
+    from pathlib import Path
+
+    import azure.cognitiveservices.speech as speechsdk
+
 _LOG = getLogger(__name__)
 
-# Audio format enums for Azure Speech API
+
+@cache
+def _sdk() -> ModuleType:
+    """Return the Azure Speech SDK module, imported on first use."""
+    # Imported here, as importing the Azure SDK is slow
+    # and not needed unless this service is used
+    import azure.cognitiveservices.speech as speechsdk
+
+    return speechsdk
+
+
+# Names of audio format enums for Azure Speech API
 # https://learn.microsoft.com/en-us/javascript/api/microsoft-cognitiveservices-speech-sdk/speechsynthesisoutputformat
-_AzureSDKAudioFmts = speechsdk.SpeechSynthesisOutputFormat
-_fmt2enum: dict[str, _AzureSDKAudioFmts] = {
-    "mp3": _AzureSDKAudioFmts.Audio16Khz32KBitRateMonoMp3,
-    "pcm": _AzureSDKAudioFmts.Raw16Khz16BitMonoPcm,
-    "opus": _AzureSDKAudioFmts.Ogg16Khz16BitMonoOpus,
+_fmt2enum: dict[str, str] = {
+    "mp3": "Audio16Khz32KBitRateMonoMp3",
+    "pcm": "Raw16Khz16BitMonoPcm",
+    "opus": "Ogg16Khz16BitMonoOpus",
 }
+# SSML envelope for Azure, see
+# https://learn.microsoft.com/en-us/azure/cognitive-services/speech-service/speech-synthesis-markup
+_SSML_OPEN_TEMPLATE = (
+    '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{lang}">'
+    '<voice name="{voice_id}">'
+)
+_SSML_CLOSE = "</voice></speak>"
+# Bytes per Azure audio offset tick (100 ns) in the "pcm" format
+# (16 kHz, 16 bit mono), used to split batched audio at bookmarks
+_PCM_BYTES_PER_TICK = 16_000 * 2 / 10_000_000
 _AZURE_VOICES: ModuleVoicesT = {
     # Icelandic
     "Gudrun": {"id": "is-IS-GudrunNeural", "lang": "is-IS", "style": "female"},
@@ -81,9 +112,87 @@ _AZURE_VOICES: ModuleVoicesT = {
 }
 
 
+@cache
+def _default_credentials() -> tuple[str, str]:
+    """Return (subscription key, region) for the default Azure keys, read on first use."""
+    if API_KEYS.azure is None:
+        raise RuntimeError("Azure API keys missing.")
+    return API_KEYS.azure.key.get_secret_value(), API_KEYS.azure.region.get_secret_value()
+
+
+def _credentials(keys_override: Keys | None) -> tuple[str, str]:
+    """Return (subscription key, region), preferring overridden keys."""
+    if keys_override and keys_override.azure:
+        _LOG.debug("Using overridden Azure keys")
+        return keys_override.azure.key.get_secret_value(), keys_override.azure.region.get_secret_value()
+    _LOG.debug("Using default Azure keys")
+    return _default_credentials()
+
+
+# Idle synthesizers, keyed by (subscription, region, voice ID, audio format).
+# Creating a synthesizer means a new connection (and TLS handshake) to Azure,
+# so synthesizers are reused. Each one is only used by one thread at a time.
+_SynthKeyT = tuple[str, str, str, str]
+_SYNTH_POOL: defaultdict[_SynthKeyT, list[speechsdk.SpeechSynthesizer]] = defaultdict(list)
+_SYNTH_POOL_LOCK = Lock()
+# Max number of idle synthesizers kept per key
+_SYNTH_POOL_MAX_IDLE = 8
+
+
+def _acquire_synthesizer(key: _SynthKeyT) -> speechsdk.SpeechSynthesizer:
+    """Borrow a synthesizer from the pool, creating one if none is idle."""
+    with _SYNTH_POOL_LOCK:
+        idle = _SYNTH_POOL[key]
+        if idle:
+            return idle.pop()
+    return _new_synthesizer(*key)
+
+
+def _release_synthesizer(key: _SynthKeyT, synthesizer: speechsdk.SpeechSynthesizer) -> None:
+    """
+    Return a borrowed synthesizer to the pool.
+    Only call this after a successful synthesis, as a synthesizer which
+    raised or returned a canceled result (auth, network, throttling)
+    might be in a broken state and is simply discarded.
+    """
+    with _SYNTH_POOL_LOCK:
+        idle = _SYNTH_POOL[key]
+        if len(idle) < _SYNTH_POOL_MAX_IDLE:
+            idle.append(synthesizer)
+
+
+def _new_synthesizer(subscription: str, region: str, voice_id: str, audio_format: str) -> speechsdk.SpeechSynthesizer:
+    sdk = _sdk()
+    speech_conf = sdk.SpeechConfig(subscription=subscription, region=region)
+    speech_conf.speech_synthesis_voice_name = voice_id
+    speech_conf.set_speech_synthesis_output_format(getattr(sdk.SpeechSynthesisOutputFormat, _fmt2enum[audio_format]))
+    # No audio config, synthesized audio is returned in the result
+    return sdk.SpeechSynthesizer(speech_config=speech_conf, audio_config=None)
+
+
+def _prewarm_synthesizer(voice_id: str, audio_format: str) -> None:
+    """
+    Add a synthesizer with an open connection to the pool,
+    so the first TTS request doesn't pay for the connection setup.
+    """
+    try:
+        subscription, region = _default_credentials()
+        synthesizer = _new_synthesizer(subscription, region, voice_id, audio_format)
+        _sdk().Connection.from_speech_synthesizer(synthesizer).open(for_continuous_recognition=True)
+        with _SYNTH_POOL_LOCK:
+            _SYNTH_POOL[(subscription, region, voice_id, audio_format)].append(synthesizer)
+        _LOG.debug("Pre-warmed Azure synthesizer for voice %s", voice_id)
+    except Exception as e:
+        _LOG.debug("Failed to pre-warm Azure synthesizer: %s", e)
+
+
 class AzureVoice(BaseVoice):
     _NAME: str = "Azure"
     _VOICES: ModuleVoicesT = _AZURE_VOICES
+    # Voice name -> (Azure voice ID, opening SSML tags for the voice)
+    _VOICE_PARAMS: dict[str, tuple[str, str]] = {
+        k: (v["id"], _SSML_OPEN_TEMPLATE.format(lang=v["lang"], voice_id=v["id"])) for k, v in _AZURE_VOICES.items()
+    }
     _AUDIO_FORMATS: ModuleAudioFormatsT = frozenset(_fmt2enum.keys())
 
     class Transcriber(DefaultTranscriber):
@@ -173,60 +282,64 @@ class AzureVoice(BaseVoice):
         if API_KEYS.azure is None:
             raise RuntimeError("Azure API keys missing.")
 
-        AzureVoice.AZURE_KEY = API_KEYS.azure.key.get_secret_value()
-        AzureVoice.AZURE_REGION = API_KEYS.azure.region.get_secret_value()
+        # Optionally, if the default voice is an Azure voice,
+        # open a connection for it in the background, ready for the first request
+        if (
+            SETTINGS.AZURE_PREWARM
+            and SETTINGS.DEFAULT_VOICE in AzureVoice._VOICE_PARAMS
+            and SETTINGS.DEFAULT_AUDIO_FORMAT in _fmt2enum
+        ):
+            Thread(
+                target=_prewarm_synthesizer,
+                args=(AzureVoice._VOICE_PARAMS[SETTINGS.DEFAULT_VOICE][0], SETTINGS.DEFAULT_AUDIO_FORMAT),
+                name="azure_prewarm",
+                daemon=True,
+            ).start()
 
     @override
     def text_to_speech(self, text: str, options: TTSOptions, keys_override: Keys | None = None):
-        if keys_override and keys_override.azure:
-            _LOG.debug("Using overridden Azure keys")
-            subscription = keys_override.azure.key.get_secret_value()
-            region = keys_override.azure.region.get_secret_value()
-        else:
-            _LOG.debug("Using default Azure keys")
-            subscription = AzureVoice.AZURE_KEY
-            region = AzureVoice.AZURE_REGION
-        speech_conf = speechsdk.SpeechConfig(subscription=subscription, region=region)
-
-        azure_voice_id = AzureVoice._VOICES[options.voice]["id"]
-        speech_conf.speech_synthesis_voice_name = azure_voice_id
-
-        fmt = _fmt2enum[options.audio_format]
-        speech_conf.set_speech_synthesis_output_format(fmt)
+        subscription, region = _credentials(keys_override)
+        azure_voice_id, ssml_open = AzureVoice._VOICE_PARAMS[options.voice]
 
-        outfile = SETTINGS.get_empty_file(options.audio_format)
         try:
-            audio_config = speechsdk.audio.AudioOutputConfig(filename=str(outfile))  # pyright: ignore[reportArgumentType]
-
-            # Init synthesizer
-            synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_conf, audio_config=audio_config)
-
-            result: speechsdk.SpeechSynthesisResult
             # Azure Speech API supports SSML but the notation is a bit different from Amazon Polly's
             # See https://learn.microsoft.com/en-us/azure/cognitive-services/speech-service/speech-synthesis-markup
-            if options.text_format == "ssml":
-                # Adjust speed
+            if options.text_format is TextFormats.SSML:
+                # Wrap text in the required <speak> and <voice> tags,
+                # adjusting speed as appropriate
                 if options.speed != 1.0:
-                    text = f'<prosody rate="{options.speed}">{text}</prosody>'
-                # Wrap text in the required <speak> and <voice> tags
-                text = f"""
-                    <speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{azure_voice_id[:5]}">
-                    <voice name="{azure_voice_id}">
-                    {text}
-                    </voice></speak>
-                """.strip()
+                    text = f'{ssml_open}<prosody rate="{options.speed}">{text}</prosody>{_SSML_CLOSE}'
+                else:
+                    text = f"{ssml_open}{text}{_SSML_CLOSE}"
+            else:
+                # We're not sending SSML so strip any markup from text
+                text = strip_markup(text)
 
+            result: speechsdk.SpeechSynthesisResult
+            key = (subscription, region, azure_voice_id, options.audio_format)
+            synthesizer = _acquire_synthesizer(key)
+            if options.text_format is TextFormats.SSML:
                 _LOG.debug("Synthesizing SSML with Azure: %r", text)
                 result = synthesizer.speak_ssml(text)
             else:
-                # We're not sending SSML so strip any markup from text
-                text = strip_markup(text)
                 _LOG.debug("Synthesizing plaintext with Azure: %r", text)
                 result = synthesizer.speak_text(text)
 
             # Check result
-            if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                # Success, return path to the generated audio file
+            sdk = _sdk()
+            if result.reason == sdk.ResultReason.SynthesizingAudioCompleted:
+                _release_synthesizer(key, synthesizer)
+                if _LOG.isEnabledFor(DEBUG):
+                    # Connection latency is ~0 when a pooled synthesizer is reused
+                    props = result.properties
+                    _LOG.debug(
+                        "Azure synthesis latency (ms), connection: %s, first byte: %s",
+                        props.get_property(sdk.PropertyId.SpeechServiceResponse_SynthesisConnectionLatencyMs),
+                        props.get_property(sdk.PropertyId.SpeechServiceResponse_SynthesisFirstByteLatencyMs),
+                    )
+                # Success, write audio to file and return its path
+                outfile = SETTINGS.get_empty_file(options.audio_format)
+                outfile.write_bytes(result.audio_data)
                 return outfile
 
             cancellation_details = result.cancellation_details
@@ -234,3 +347,73 @@ class AzureVoice(BaseVoice):
         except Exception:
             _LOG.exception("Error communicating with Azure Speech API.")
             raise
+
+    @override
+    def batch_text_to_speech(
+        self, texts: Iterable[str], options: TTSOptions, keys_override: Keys | None = None
+    ) -> list[Path]:
+        """
+        Raw PCM audio for several plain texts is synthesized in a single request,
+        with a bookmark between consecutive texts, and the audio is then split
+        at the bookmarks' audio offsets.
+        Other audio formats can't be split cleanly, so one request is sent per text.
+        """
+        texts = list(texts)
+        if len(texts) <= 1 or options.audio_format != "pcm" or options.text_format is TextFormats.SSML:
+            return super().batch_text_to_speech(texts, options, keys_override)
+
+        subscription, region = _credentials(keys_override)
+        azure_voice_id, ssml_open = AzureVoice._VOICE_PARAMS[options.voice]
+        # (Azure doesn't allow <s> inside <prosody>, so each sentence gets its own)
+        if options.speed != 1.0:
+            s_open, s_close = f'<s><prosody rate="{options.speed}">', "</prosody></s>"
+        else:
+            s_open, s_close = "<s>", "</s>"
+        parts = [ssml_open]
+        for i, text in enumerate(texts):
+            if i:
+                parts.append(f'<bookmark mark="{i}"/>')
+            parts += (s_open, escape(strip_markup(text)), s_close)
+        parts.append(_SSML_CLOSE)
+        ssml = "".join(parts)
+
+        # Bookmark name -> audio offset (in ticks of 100 ns)
+        offsets: dict[str, int] = {}
+
+        def _on_bookmark(evt: speechsdk.SpeechSynthesisBookmarkEventArgs) -> None:
+            offsets[evt.text] = evt.audio_offset
+
+        try:
+            key = (subscription, region, azure_voice_id, options.audio_format)
+            synthesizer = _acquire_synthesizer(key)
+            _LOG.debug("Synthesizing batch of %d texts with Azure: %r", len(texts), ssml)
+            synthesizer.bookmark_reached.connect(_on_bookmark)
+            try:
+                result = synthesizer.speak_ssml(ssml)
+            finally:
+                synthesizer.bookmark_reached.disconnect_all()
+        except Exception:
+            _LOG.exception("Error communicating with Azure Speech API.")
+            raise
+        if result.reason != _sdk().ResultReason.SynthesizingAudioCompleted:
+            # A single bad text shouldn't fail the whole batch
+            _LOG.warning(
+                "Batched Azure TTS failed (%s), synthesizing texts separately.",
+                result.cancellation_details.error_details,
+            )
+            return super().batch_text_to_speech(texts, options, keys_override)
+        _release_synthesizer(key, synthesizer)
+
+        if len(offsets) != len(texts) - 1:
+            _LOG.warning("Missing bookmarks in batched Azure audio, synthesizing texts separately.")
+            return super().batch_text_to_speech(texts, options, keys_override)
+
+        audio = result.audio_data
+        # Split on sample boundaries
+        bounds = [0, *(2 * int(offsets[str(i)] * _PCM_BYTES_PER_TICK / 2) for i in range(1, len(texts))), len(audio)]
+        outfiles: list[Path] = []
+        for start, end in zip(bounds, bounds[1:]):
+            outfile = SETTINGS.get_empty_file(options.audio_format)
+            outfile.write_bytes(audio[start:end])
+            outfiles.append(outfile)
+        return outfiles
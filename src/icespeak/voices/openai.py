@@ -23,23 +23,48 @@ Icelandic-language text to speech via the OpenAI Speech API.
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING
 from typing_extensions import override
 
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, lru_cache
 from logging import getLogger
 
-from openai import OpenAI
+from tokenizer import split_into_sentences
 
-from icespeak.settings import API_KEYS, SETTINGS, Keys
+from icespeak.settings import API_KEYS, SETTINGS, Keys, TextFormats
 
-from . import BaseVoice, ModuleAudioFormatsT, ModuleVoicesT, TTSOptions
+from . import BATCH_MAX_WORKERS, BaseVoice, ModuleAudioFormatsT, ModuleVoicesT, TTSOptions
 
 if TYPE_CHECKING:
     from pathlib import Path
 
+    from openai import OpenAI
+
 _LOG = getLogger(__name__)
 
 
+def _create_client(openai_key: str) -> OpenAI:
+    # Imported here, as importing openai is slow
+    # and not needed unless this service is used
+    from openai import OpenAI
+
+    return OpenAI(api_key=openai_key)
+
+
+# Clients for overridden keys, so repeated overrides reuse
+# a client (and its connection pool) instead of creating a new one per call
+_override_client = lru_cache(maxsize=8)(_create_client)
+
+
+@cache
+def _default_client() -> OpenAI:
+    """Return client using the default OpenAI key, created on first use."""
+    assert API_KEYS.openai, "OpenAI API key missing."
+    return _create_client(API_KEYS.openai.api_key.get_secret_value())
+
+
 class OpenAIVoice(BaseVoice):
     _NAME: str = "OpenAI"
     _VOICES: ModuleVoicesT = {
@@ -57,9 +82,12 @@ class OpenAIVoice(BaseVoice):
         "shimmer_hd": {"id": "shimmer_hd", "lang": "en-US", "style": "female"},
     }
     _AUDIO_FORMATS: ModuleAudioFormatsT = frozenset(("mp3", "opus", "aac", "flac", "wav", "pcm"))
-
-    def _create_client(self, openai_key: str) -> OpenAI:
-        return OpenAI(api_key=openai_key)
+    # Audio formats whose files can be joined by simple concatenation
+    _CONCAT_FORMATS: ModuleAudioFormatsT = frozenset(("mp3", "pcm"))
+    # If SETTINGS.OPENAI_SPLIT_SENTENCES is set, plain texts longer than this
+    # (in characters) are synthesized one sentence at a time,
+    # see `_text_to_speech_by_sentence`
+    _SPLIT_MIN_LEN: int = 500
 
     @property
     @override
@@ -80,18 +108,28 @@ class OpenAIVoice(BaseVoice):
     def load_api_keys(self) -> None:
         assert API_KEYS.openai, "OpenAI API key missing"
 
-        self._openai_client: Any = None
-        if self._openai_client is None:
-            self._openai_client = self._create_client(API_KEYS.openai.api_key.get_secret_value())
-
     @override
     def text_to_speech(self, text: str, options: TTSOptions, keys_override: Keys | None = None) -> Path:
+        if (
+            SETTINGS.OPENAI_SPLIT_SENTENCES
+            and len(text) > OpenAIVoice._SPLIT_MIN_LEN
+            and options.audio_format in OpenAIVoice._CONCAT_FORMATS
+            and options.text_format is not TextFormats.SSML
+        ):
+            sentences = [s.strip() for s in split_into_sentences(text, original=True)]
+            sentences = [s for s in sentences if s]
+            if len(sentences) > 1:
+                return self._text_to_speech_by_sentence(sentences, options, keys_override)
+        return self._synthesize(text, options, keys_override)
+
+    def _synthesize(self, text: str, options: TTSOptions, keys_override: Keys | None) -> Path:
+        """Synthesize speech for the text with a single request."""
         if keys_override and keys_override.openai:
             _LOG.debug("Using overridden OpenAI keys")
-            client = self._create_client(keys_override.openai.api_key.get_secret_value())
+            client = _override_client(keys_override.openai.api_key.get_secret_value())
         else:
             _LOG.debug("Using default OpenAI keys")
-            client = self._openai_client
+            client = _default_client()
 
         try:
             voice = OpenAIVoice._VOICES[options.voice]["id"]
@@ -109,9 +147,38 @@ class OpenAIVoice(BaseVoice):
             _LOG.debug("Synthesizing with OpenAI: %s", openai_args)
             with client.audio.speech.with_streaming_response.create(**openai_args) as response:
                 outfile = SETTINGS.get_empty_file(options.audio_format)
-                response.stream_to_file(outfile)
+                # Write in 64 KiB chunks, rather than as each network read arrives
+                response.stream_to_file(outfile, chunk_size=1 << 16)
         except Exception:
             _LOG.exception("OpenAI TTS failed")
             raise
 
         return outfile
+
+    def _text_to_speech_by_sentence(
+        self, sentences: list[str], options: TTSOptions, keys_override: Keys | None
+    ) -> Path:
+        """
+        Synthesize speech for several sentences by sending them
+        as concurrent requests and concatenating the audio,
+        so a long text doesn't wait on a single long request.
+        Only for audio formats which can be concatenated ("mp3" and "pcm").
+        """
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(sentences))) as executor:
+            futures = [executor.submit(self._synthesize, s, options, keys_override) for s in sentences]
+        # All requests have finished once the executor has shut down
+        parts = [f.result() for f in futures if f.exception() is None]
+        outfile = SETTINGS.get_empty_file(options.audio_format)
+        try:
+            with outfile.open("wb") as out:
+                for future in futures:
+                    # (Raises the error of the first failed request)
+                    with future.result().open("rb") as f:
+                        shutil.copyfileobj(f, out, 1 << 16)
+        except BaseException:
+            outfile.unlink(missing_ok=True)
+            raise
+        finally:
+            for part in parts:
+                part.unlink(missing_ok=True)
+        return outfile
@@ -21,13 +21,16 @@ along with this program.  If not, see http://www.gnu.org/licenses/.
 
 from __future__ import annotations
 
+from typing import Any
 from typing_extensions import override
 
 import shlex
 import shutil
 import subprocess
+import wave
 from logging import getLogger
 from pathlib import Path
+from threading import Lock, Thread
 
 from icespeak.settings import SETTINGS, Keys
 
@@ -35,6 +38,66 @@ from . import BaseVoice, ModuleAudioFormatsT, ModuleVoicesT, TTSOptions
 
 _LOG = getLogger(__name__)
 
+# Loaded Piper voice models, by model path, kept between requests
+# so each model is only loaded once.
+# (A loaded model can synthesize from several threads at once.)
+_MODELS: dict[Path, Any] = {}
+# Per-model locks, so loading one model doesn't block
+# requests for models which are already loaded
+# (both dicts guarded by _MODELS_LOCK)
+_MODEL_LOCKS: dict[Path, Lock] = {}
+_MODELS_LOCK = Lock()
+
+
+def _load_model(model_path: Path) -> Any | None:
+    """Load the Piper voice model at `model_path`, see `_get_model`."""
+    try:
+        # Imported here, as importing piper (and onnxruntime) is slow
+        # and not needed unless this service is used
+        from piper import PiperVoice
+
+        if not hasattr(PiperVoice, "synthesize_wav"):
+            return None
+        _LOG.debug("Loading Piper model: %s", model_path)
+        return PiperVoice.load(model_path)
+    except Exception:
+        _LOG.warning("Failed to load Piper model %s, using piper executable instead.", model_path, exc_info=True)
+        return None
+
+
+def _get_model(model_path: Path) -> Any | None:
+    """
+    Return the loaded Piper voice model at `model_path`, loading it if needed.
+    Returns None if the model hasn't been downloaded, if the installed
+    piper package doesn't support in-process synthesis (piper-tts<1.3)
+    or if loading the model failed, in which case the piper executable
+    should be used instead.
+    """
+    with _MODELS_LOCK:
+        if model_path in _MODELS:
+            return _MODELS[model_path]
+        model_lock = _MODEL_LOCKS.setdefault(model_path, Lock())
+    with model_lock:
+        with _MODELS_LOCK:
+            # Another thread might have loaded it while we waited
+            if model_path in _MODELS:
+                return _MODELS[model_path]
+        if not model_path.is_file():
+            return None
+        piper_voice = _load_model(model_path)
+        with _MODELS_LOCK:
+            _MODELS[model_path] = piper_voice
+        return piper_voice
+
+
+def _preload_model(model_path: Path) -> None:
+    """Load a Piper voice model ahead of the first TTS request."""
+    try:
+        if _get_model(model_path) is not None:
+            _LOG.debug("Pre-loaded Piper model: %s", model_path)
+    except Exception as e:
+        _LOG.debug("Failed to pre-load Piper model: %s", e)
+
 
 class PiperTTSVoice(BaseVoice):
     _NAME: str = "Piper"
@@ -49,6 +112,22 @@ class PiperTTSVoice(BaseVoice):
     @override
     def __init__(self) -> None:
         self._avail = True
+        # Optionally load the default voice's model in the background,
+        # ready for the first request
+        if SETTINGS.PIPER_PRELOAD and SETTINGS.DEFAULT_VOICE in PiperTTSVoice._VOICES:
+            Thread(
+                target=_preload_model,
+                args=(PiperTTSVoice._model_path(SETTINGS.DEFAULT_VOICE),),
+                name="piper_preload",
+                daemon=True,
+            ).start()
+
+    @staticmethod
+    def _model_path(voice_name: str) -> Path:
+        """Path of the Piper model for the given voice, in the Piper data directory."""
+        voice = PiperTTSVoice._VOICES[voice_name]
+        model = f"{voice['lang'].replace('-','_')}-{voice['id']}"
+        return SETTINGS.get_audio_dir() / "Piper" / f"{model}.onnx"
 
     @property
     @override
@@ -86,6 +165,21 @@ class PiperTTSVoice(BaseVoice):
             voice = self.voices[options.voice]
             model = f"{voice['lang'].replace('-','_')}-{voice['id']}"
             data_dir = audio_dir / "Piper"
+
+            piper_voice = _get_model(PiperTTSVoice._model_path(options.voice))
+            if piper_voice is not None and options.audio_format in PiperTTSVoice._AUDIO_FORMATS:
+                _LOG.debug("Synthesizing with loaded Piper model %s: %r", model, text)
+                if options.audio_format == "pcm":
+                    with outfile.open("wb") as f:
+                        for chunk in piper_voice.synthesize(text):
+                            f.write(chunk.audio_int16_bytes)
+                else:
+                    with wave.open(str(outfile), "wb") as wav_file:
+                        piper_voice.synthesize_wav(text, wav_file)
+                return outfile
+
+            # Fall back to running the piper executable
+            # (which downloads the model if needed)
             piper_args = {
                 "model": shlex.quote(str(model)),
                 "voice": voice["id"],
@@ -22,21 +22,51 @@ along with this program.  If not, see http://www.gnu.org/licenses/.
 # ruff: noqa: S106
 from __future__ import annotations
 
+import asyncio
+import os
+import sys
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 import pytest
 from pydantic import SecretStr
 
-from icespeak import TTSOptions, tts_to_file
+import icespeak.tts
+from icespeak import SETTINGS, TTSOptions, tts_to_file
 from icespeak.settings import (
     API_KEYS,
     AWSPollyKey,
     Keys,
+    OpenAIKey,
     TextFormats,
     suffix_for_audiofmt,
 )
 from icespeak.transcribe import strip_markup
-from icespeak.tts import SERVICES, VOICES
+from icespeak.tts import SERVICES, VOICE_TO_SERVICE, VOICES, TTSOutput
+
+
+@pytest.fixture(autouse=True)
+def _isolated_audio_cache(monkeypatch: pytest.MonkeyPatch):
+    """
+    Give each test an empty audio cache and set of uncached files,
+    so entries from one test don't leak into others or get deleted upon exit.
+    """
+    monkeypatch.setattr(icespeak.tts, "_AUDIO_CACHE", icespeak.tts.TmpFileLFUCache(maxsize=SETTINGS.AUDIO_CACHE_SIZE))
+    monkeypatch.setattr(icespeak.tts, "_UNCACHED_FILES", icespeak.tts.OrderedDict())
+
+
+@pytest.fixture
+def mock_service():
+    """Register a mock TTS service (supporting "mp3") with the voice "Dora"."""
+    service = MagicMock()
+    service.audio_formats = ["mp3"]
+    with patch.dict(SERVICES, {"mock_service": service}), patch.dict(
+        VOICES, {"Dora": {"service": "mock_service"}}
+    ), patch.dict(VOICE_TO_SERVICE, {"Dora": service}):
+        yield service
 
 
 def test_voices_utils():
@@ -154,14 +184,420 @@ def test_keys_override_in_tts_to_file():
         )
     )
     opts = TTSOptions(text_format=TextFormats.TEXT, audio_format="mp3", voice="Dora")
-    tts_to_file(
-        _TEXT,
-        opts,
-        transcribe=False,
-        keys_override=keys_override,
-    )
+    with patch.dict(VOICE_TO_SERVICE, {"Dora": SERVICES["mock_service"]}):
+        tts_to_file(
+            _TEXT,
+            opts,
+            transcribe=False,
+            keys_override=keys_override,
+        )
     SERVICES["mock_service"].text_to_speech.assert_called_once_with( # type: ignore
         _TEXT,
         opts,
         keys_override,
     )
+
+
+@patch.object(SETTINGS, "AUDIO_CACHE_ENABLED", new=True)
+def test_tts_to_file_unhashable_keys_override(mock_service: MagicMock, tmp_path: Path):
+    """Test that keys overrides (which may hold unhashable values) aren't part of the cache key."""
+    mock_service.text_to_speech.return_value = tmp_path / "keys.mp3"
+    opts = TTSOptions(text_format=TextFormats.TEXT, audio_format="mp3", voice="Dora")
+    keys_override = Keys(google={"type": "service_account", "project_id": "test"})
+
+    tts_to_file("Lyklar", opts, transcribe=False, keys_override=keys_override)
+    tts_to_file("Lyklar", opts, transcribe=False)
+    mock_service.text_to_speech.assert_called_once_with("Lyklar", opts, keys_override)
+
+
+@patch.object(SETTINGS, "AUDIO_CACHE_ENABLED", new=True)
+def test_tts_to_file_cache_bypass(mock_service: MagicMock, tmp_path: Path):
+    """Test that long untranscribed texts bypass the audio cache."""
+    mock_service.text_to_speech.return_value = tmp_path / "short.mp3"
+    opts = TTSOptions(text_format=TextFormats.TEXT, audio_format="mp3", voice="Dora")
+
+    short_text = "Stuttur texti"
+    tts_to_file(short_text, opts, transcribe=False)
+    tts_to_file(short_text, opts, transcribe=False)
+    assert mock_service.text_to_speech.call_count == 1
+
+    long_file = tmp_path / "long.mp3"
+    mock_service.text_to_speech.return_value = long_file
+    long_text = "a" * (SETTINGS.AUDIO_CACHE_MAX_KEY_LEN + 1)
+    with patch.object(SETTINGS, "AUDIO_CACHE_CLEAN", new=True):
+        tts_to_file(long_text, opts, transcribe=False)
+        tts_to_file(long_text, opts, transcribe=False)
+    assert mock_service.text_to_speech.call_count == 3
+    # Uncached files are still deleted upon exit
+    assert os.fspath(long_file) in icespeak.tts._UNCACHED_FILES
+
+
+def test_tts_to_file_cache_disabled(mock_service: MagicMock, tmp_path: Path):
+    """Test that the audio cache is off by default, so each caller gets its own file."""
+    assert not SETTINGS.AUDIO_CACHE_ENABLED
+    files = [tmp_path / "a.mp3", tmp_path / "b.mp3"]
+    mock_service.text_to_speech.side_effect = files
+    opts = TTSOptions(text_format=TextFormats.TEXT, audio_format="mp3", voice="Dora")
+
+    with patch.object(SETTINGS, "AUDIO_CACHE_CLEAN", new=True):
+        out1 = tts_to_file("Ekki í skyndiminni", opts, transcribe=False)
+        out2 = tts_to_file("Ekki í skyndiminni", opts, transcribe=False)
+    assert out1.file != out2.file
+    # Neither file is in the cache, so neither is deleted by an eviction,
+    # but both are deleted upon exit
+    assert list(icespeak.tts._UNCACHED_FILES) == [os.fspath(f) for f in files]
+
+
+def test_uncached_files_limit(monkeypatch: pytest.MonkeyPatch):
+    """Test that uncached audio files are only deleted while running if a limit is set."""
+    monkeypatch.setattr(SETTINGS, "AUDIO_CACHE_CLEAN", True)
+    with patch.object(icespeak.tts, "_EXPIRED_QUEUE") as mock_queue:
+        for name in ("a.wav", "b.wav", "c.wav"):
+            icespeak.tts._track_uncached(TTSOutput(Path(name), ""))
+        # No limit by default, all are kept until exit
+        assert list(icespeak.tts._UNCACHED_FILES) == ["a.wav", "b.wav", "c.wav"]
+        mock_queue.put.assert_not_called()
+
+        monkeypatch.setattr(SETTINGS, "AUDIO_MAX_UNCACHED_FILES", 2)
+        icespeak.tts._track_uncached(TTSOutput(Path("d.wav"), ""))
+    assert list(icespeak.tts._UNCACHED_FILES) == ["c.wav", "d.wav"]
+    assert [c.args[0] for c in mock_queue.put.call_args_list] == ["a.wav", "b.wav"]
+
+
+def test_tts_to_file_invalid_options():
+    """Test that invalid options are rejected before the audio cache is consulted."""
+    with patch("icespeak.tts.hashkey") as mock_hashkey:
+        with pytest.raises(ValueError, match="not available"):
+            tts_to_file("Test", TTSOptions(voice="NonexistentVoice"))
+        for text in ("", " \n\t", "<b></b>", " <p> </p>"):
+            with pytest.raises(ValueError, match="No text to synthesize"):
+                tts_to_file(text, TTSOptions(text_format=TextFormats.TEXT))
+        mock_hashkey.assert_not_called()
+
+
+def test_tts_options_speed():
+    """Test that TTS speed is restricted to a finite, supported range."""
+    assert TTSOptions(speed=1.5).speed == 1.5
+    for speed, message in (
+        (0.1, "greater than or equal to"),
+        (10.0, "less than or equal to"),
+        (float("nan"), "finite number"),
+        (float("inf"), "finite number"),
+    ):
+        with pytest.raises(ValueError, match=message):
+            TTSOptions(speed=speed)
+
+
+def test_text_to_speech_async():
+    """Test that the async TTS method delegates to the service's text_to_speech."""
+    service = SERVICES["Piper"]
+    opts = TTSOptions(voice="bui")
+    with patch.object(service, "text_to_speech", return_value="out.wav") as mock_tts:
+        assert asyncio.run(service.text_to_speech_async(_TEXT, opts)) == "out.wav"
+    mock_tts.assert_called_once_with(_TEXT, opts, None)
+
+
+def test_batch_text_to_speech():
+    """Test that batch TTS synthesizes every text and preserves order."""
+    service = SERVICES["Piper"]
+    opts = TTSOptions(voice="bui")
+    texts = [f"Setning {i}" for i in range(20)]
+    with patch.object(service, "text_to_speech", side_effect=lambda t, o, k: f"{t}.wav") as mock_tts:
+        assert service.batch_text_to_speech(texts, opts) == [f"{t}.wav" for t in texts]
+    assert mock_tts.call_count == len(texts)
+
+
+def test_azure_batch_text_to_speech():
+    """Test that Azure batches PCM audio into one request, split at bookmarks."""
+    import azure.cognitiveservices.speech as speechsdk
+
+    from icespeak.voices import azure
+
+    bookmark_callbacks = []
+    synthesizer = MagicMock()
+    synthesizer.bookmark_reached.connect.side_effect = bookmark_callbacks.append
+
+    def speak_ssml(ssml: str) -> MagicMock:
+        assert ssml.count("<bookmark mark=") == 2
+        for name, offset in (("1", 10_000), ("2", 25_000)):
+            for cb in bookmark_callbacks:
+                cb(MagicMock(text=name, audio_offset=offset))
+        return MagicMock(reason=speechsdk.ResultReason.SynthesizingAudioCompleted, audio_data=bytes(range(100)))
+
+    synthesizer.speak_ssml.side_effect = speak_ssml
+    opts = TTSOptions(voice="Gudrun", audio_format="pcm")
+    with patch.object(azure, "_new_synthesizer", return_value=synthesizer), patch.dict(
+        azure._SYNTH_POOL, clear=True
+    ), patch.object(azure, "_default_credentials", return_value=("key", "region")):
+        files = azure.AzureVoice().batch_text_to_speech(["Einn", "Tveir & þrír", "Fjórir"], opts)
+    try:
+        # 16 kHz, 16 bit: 1 ms (10000 ticks) is 32 bytes
+        assert [f.read_bytes() for f in files] == [bytes(range(32)), bytes(range(32, 80)), bytes(range(80, 100))]
+    finally:
+        for f in files:
+            f.unlink()
+    synthesizer.bookmark_reached.disconnect_all.assert_called_once()
+
+    # A failed batch falls back to one request per text
+    synthesizer.speak_ssml.side_effect = None
+    synthesizer.speak_ssml.return_value = MagicMock(reason=speechsdk.ResultReason.Canceled)
+    with patch.object(azure, "_new_synthesizer", return_value=synthesizer), patch.object(
+        azure, "_default_credentials", return_value=("key", "region")
+    ), patch.object(azure.AzureVoice, "text_to_speech", side_effect=lambda t, o, k: f"{t}.pcm") as mock_tts:
+        assert azure.AzureVoice().batch_text_to_speech(["Einn", "Tveir"], opts) == ["Einn.pcm", "Tveir.pcm"]
+    assert mock_tts.call_count == 2
+
+
+def test_azure_synthesizer_pool():
+    """Test that Azure synthesizers are only reused after a successful synthesis."""
+    import azure.cognitiveservices.speech as speechsdk
+
+    from icespeak.voices import azure
+
+    synthesizer = MagicMock()
+    synthesizer.speak_text.return_value = MagicMock(reason=speechsdk.ResultReason.Canceled)
+    opts = TTSOptions(voice="Gudrun", text_format=TextFormats.TEXT, audio_format="mp3")
+    with patch.object(azure, "_new_synthesizer", return_value=synthesizer), patch.dict(
+        azure._SYNTH_POOL, clear=True
+    ), patch.object(azure, "_default_credentials", return_value=("key", "region")):
+        with pytest.raises(RuntimeError, match="TTS with Azure failed"):
+            azure.AzureVoice().text_to_speech("Halló", opts)
+        # Failed synthesizer is discarded
+        assert not any(azure._SYNTH_POOL.values())
+
+        synthesizer.speak_text.return_value = MagicMock(
+            reason=speechsdk.ResultReason.SynthesizingAudioCompleted, audio_data=b"mp3"
+        )
+        azure.AzureVoice().text_to_speech("Halló", opts).unlink()
+        assert azure._SYNTH_POOL[("key", "region", "is-IS-GudrunNeural", "mp3")] == [synthesizer]
+
+
+def test_piper_loaded_model():
+    """Test that Piper synthesizes with a loaded model instead of the executable."""
+    from icespeak.voices import piper_tts
+
+    def synthesize_wav(text: str, wav_file: wave.Wave_write) -> None:
+        wav_file.setframerate(22050)
+        wav_file.setsampwidth(2)
+        wav_file.setnchannels(1)
+        wav_file.writeframes(bytes(100))
+
+    piper_voice = MagicMock()
+    piper_voice.synthesize_wav.side_effect = synthesize_wav
+    with patch.object(piper_tts, "_get_model", return_value=piper_voice) as mock_get_model, patch.object(
+        piper_tts.subprocess, "run"
+    ) as mock_run:
+        outfile = SERVICES["Piper"].text_to_speech("Halló", TTSOptions(voice="bui", audio_format="wav"))
+    try:
+        with wave.open(str(outfile), "rb") as wav_file:
+            assert wav_file.getnframes() == 50
+    finally:
+        outfile.unlink()
+    assert mock_get_model.call_args.args[0].name == "is_IS-bui-medium.onnx"
+    piper_voice.synthesize_wav.assert_called_once()
+    mock_run.assert_not_called()
+
+
+def test_piper_model_load_failure(tmp_path: Path):
+    """Test that Piper falls back to the executable if loading a model fails."""
+    from icespeak.voices import piper_tts
+
+    model_path = tmp_path / "is_IS-bui-medium.onnx"
+    model_path.write_bytes(b"")
+    piper_module = MagicMock()
+    piper_module.PiperVoice.load.side_effect = RuntimeError("Corrupt model")
+    with patch.dict(sys.modules, {"piper": piper_module}), patch.dict(piper_tts._MODELS, clear=True):
+        assert piper_tts._get_model(model_path) is None
+        # Failure is remembered, so the model isn't loaded again for each request
+        assert piper_tts._get_model(model_path) is None
+    piper_module.PiperVoice.load.assert_called_once_with(model_path)
+
+
+def test_piper_preload():
+    """Test that the default voice's Piper model is loaded at startup, if enabled."""
+    from icespeak.voices import piper_tts
+
+    with patch.object(SETTINGS, "PIPER_PRELOAD", new=True), patch.object(
+        SETTINGS, "DEFAULT_VOICE", "bui"
+    ), patch.object(piper_tts, "_get_model") as mock_get_model:
+        piper_tts.PiperTTSVoice()
+        for t in threading.enumerate():
+            if t.name == "piper_preload":
+                t.join(5)
+    mock_get_model.assert_called_once_with(piper_tts.PiperTTSVoice._model_path("bui"))
+
+
+def test_openai_text_to_speech_by_sentence(monkeypatch: pytest.MonkeyPatch):
+    """Test that OpenAI synthesizes long texts by sentence and concatenates the audio, if enabled."""
+    from icespeak.voices import openai
+
+    monkeypatch.setattr(SETTINGS, "OPENAI_SPLIT_SENTENCES", True)
+
+    def synthesize(text: str, *args: object) -> Path:
+        part = SETTINGS.get_empty_file("mp3")
+        part.write_bytes(text.encode())
+        return part
+
+    service = openai.OpenAIVoice()
+    sentences = [f"Setning númer {i} er hérna." for i in range(30)]
+    long_text = "  ".join(sentences)
+    assert len(long_text) > openai.OpenAIVoice._SPLIT_MIN_LEN
+    opts = TTSOptions(voice="nova", audio_format="mp3")
+    with patch.object(service, "_synthesize", side_effect=synthesize) as mock_synthesize:
+        outfile = service.text_to_speech(long_text, opts)
+        assert sorted(c.args[0] for c in mock_synthesize.call_args_list) == sorted(sentences)
+
+        # Short texts and formats which can't be concatenated use a single request
+        mock_synthesize.reset_mock()
+        service.text_to_speech("Stutt. Mjög stutt.", opts).unlink()
+        service.text_to_speech(long_text, TTSOptions(voice="nova", audio_format="wav")).unlink()
+        assert mock_synthesize.call_count == 2
+
+        # Long texts use a single request unless splitting is enabled
+        monkeypatch.setattr(SETTINGS, "OPENAI_SPLIT_SENTENCES", False)
+        mock_synthesize.reset_mock()
+        service.text_to_speech(long_text, opts).unlink()
+        mock_synthesize.assert_called_once()
+    try:
+        assert outfile.read_bytes() == "".join(sentences).encode()
+    finally:
+        outfile.unlink()
+
+
+def test_openai_text_to_speech_by_sentence_failure(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that audio for each sentence is deleted if synthesizing another one fails."""
+    from icespeak.voices import openai
+
+    monkeypatch.setattr(SETTINGS, "AUDIO_DIR", tmp_path)
+    monkeypatch.setattr(SETTINGS, "OPENAI_SPLIT_SENTENCES", True)
+
+    def synthesize(text: str, *args: object) -> Path:
+        if "5" in text:
+            raise RuntimeError("TTS failed")
+        part = SETTINGS.get_empty_file("mp3")
+        part.write_bytes(text.encode())
+        return part
+
+    service = openai.OpenAIVoice()
+    long_text = " ".join(f"Setning númer {i} er hérna." for i in range(30))
+    with patch.object(service, "_synthesize", side_effect=synthesize), pytest.raises(
+        RuntimeError, match="TTS failed"
+    ):
+        service.text_to_speech(long_text, TTSOptions(voice="nova", audio_format="mp3"))
+    assert not any(f.is_file() for f in tmp_path.iterdir())
+
+
+def test_tts_to_file_in_flight_dedup(tmp_path: Path):
+    """Test that concurrent identical requests share a single synthesis."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_tts(text: str, *args: object, **kwargs: object) -> Path:
+        started.set()
+        assert release.wait(5)
+        return tmp_path / "out.wav"
+
+    service = SERVICES["Piper"]
+    opts = TTSOptions(voice="bui")
+    text = "Samhliða beiðni"
+    with patch.object(SETTINGS, "AUDIO_CACHE_ENABLED", new=True), patch.object(
+        SETTINGS, "AUDIO_CACHE_CLEAN", new=True
+    ), patch.object(service, "text_to_speech", side_effect=slow_tts) as mock_tts:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(tts_to_file, text, opts, transcribe=False)
+            assert started.wait(5)
+            second = executor.submit(tts_to_file, text, opts, transcribe=False)
+            release.set()
+            assert first.result() == second.result()
+    mock_tts.assert_called_once()
+    assert not icespeak.tts._IN_FLIGHT
+
+
+def test_tts_to_files_async():
+    """Test that bulk async TTS preserves order and synthesizes duplicates once."""
+    texts = ["Halló", "Bless", "Halló", "Já"]
+    with patch.object(
+        icespeak.tts, "tts_to_file", side_effect=lambda text, *a, **kw: TTSOutput(Path(f"{text}.wav"), text)
+    ) as mock_tts:
+        outputs = asyncio.run(icespeak.tts.tts_to_files_async(texts, TTSOptions(voice="bui"), max_concurrency=2))
+    assert [o.text for o in outputs] == texts
+    assert mock_tts.call_count == 3
+
+    # Would otherwise wait forever on a semaphore which is never released
+    with pytest.raises(ValueError, match="max_concurrency"):
+        asyncio.run(icespeak.tts.tts_to_files_async(texts, max_concurrency=0))
+
+
+def test_tts_to_file_persistent_audio(mock_service: MagicMock, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that kept audio files are content-addressed and reused."""
+    monkeypatch.setattr(SETTINGS, "AUDIO_DIR", tmp_path)
+    monkeypatch.setattr(SETTINGS, "AUDIO_CACHE_CLEAN", False)
+
+    def _mock_tts(text: str, options: TTSOptions, keys_override: Keys | None):
+        f = SETTINGS.get_empty_file(options.audio_format)
+        f.write_text(text)
+        return f
+
+    mock_service.text_to_speech.side_effect = _mock_tts
+    opts = TTSOptions(text_format=TextFormats.TEXT, audio_format="mp3", voice="Dora")
+    keys_override = Keys(openai=OpenAIKey(api_key=SecretStr("test")))
+
+    # Not cached in memory, same audio content
+    out1 = tts_to_file("Vistuð prufa", opts, transcribe=False)
+    out2 = tts_to_file("Vistuð prufa", opts, transcribe=False, keys_override=keys_override)
+    assert out1.file == out2.file
+    assert out1.file.read_text() == "Vistuð prufa"
+    assert mock_service.text_to_speech.call_count == 1
+    assert list(tmp_path.iterdir()) == [out1.file]
+
+
+def test_tts_to_file_kept_audio_limit(mock_service: MagicMock, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that least recently used kept audio files are deleted when over the size limit."""
+    monkeypatch.setattr(SETTINGS, "AUDIO_DIR", tmp_path)
+    monkeypatch.setattr(SETTINGS, "AUDIO_CACHE_CLEAN", False)
+    monkeypatch.setattr(SETTINGS, "AUDIO_DIR_MAX_BYTES", 1000)
+    monkeypatch.setattr(SETTINGS, "AUDIO_CACHE_ENABLED", True)
+    monkeypatch.setattr(icespeak.tts, "_kept_audio_size", None)
+
+    def _mock_tts(text: str, options: TTSOptions, keys_override: Keys | None):
+        f = SETTINGS.get_empty_file(options.audio_format)
+        f.write_bytes(b"x" * 300)
+        return f
+
+    mock_service.text_to_speech.side_effect = _mock_tts
+    opts = TTSOptions(text_format=TextFormats.TEXT, audio_format="mp3", voice="Dora")
+
+    outputs = []
+    for i in range(4):
+        outputs.append(tts_to_file(f"Texti {i}", opts, transcribe=False))
+        # Distinct modification times
+        os.utime(outputs[-1].file, (i, i))
+    # Limit exceeded by the fourth file, oldest trimmed to 90% of the limit
+    assert [o.file.is_file() for o in outputs] == [False, True, True, True]
+
+    # Trimmed file is synthesized again, even though it is in the memory cache
+    assert tts_to_file("Texti 0", opts, transcribe=False).file.is_file()
+    assert mock_service.text_to_speech.call_count == 5
+
+
+def test_tts_to_file_kept_audio_oversized(mock_service: MagicMock, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that a new kept audio file larger than the size limit isn't trimmed itself."""
+    monkeypatch.setattr(SETTINGS, "AUDIO_DIR", tmp_path)
+    monkeypatch.setattr(SETTINGS, "AUDIO_CACHE_CLEAN", False)
+    monkeypatch.setattr(SETTINGS, "AUDIO_DIR_MAX_BYTES", 1000)
+    monkeypatch.setattr(icespeak.tts, "_kept_audio_size", None)
+
+    def _mock_tts(text: str, options: TTSOptions, keys_override: Keys | None):
+        f = SETTINGS.get_empty_file(options.audio_format)
+        f.write_bytes(b"x" * (300 if text == "Lítill" else 2000))
+        return f
+
+    mock_service.text_to_speech.side_effect = _mock_tts
+    opts = TTSOptions(text_format=TextFormats.TEXT, audio_format="mp3", voice="Dora")
+
+    small = tts_to_file("Lítill", opts, transcribe=False)
+    os.utime(small.file, (0, 0))
+    big = tts_to_file("Stór", opts, transcribe=False)
+    # Older files are trimmed, but the new one is kept
+    assert not small.file.is_file()
+    assert big.file.is_file()